@@ -44,6 +44,7 @@ with open(os.path.join(LOCALES_PATH, 'locales.json'),
 
 from .frontend import CitationStylesStyle, CitationStylesBibliography
 from .source import Citation, CitationItem, Locator
+from .cache import RenderCache, SQLiteRenderCache
 
 from . import _version
 __version__ = _version.get_versions()['version']
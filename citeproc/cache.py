@@ -0,0 +1,207 @@
+
+import pickle
+import sqlite3
+import time
+
+from hashlib import sha1
+
+from lxml import etree
+
+from .source import LiteralDate, LRUCache
+
+
+__all__ = ['RenderCache', 'SQLiteRenderCache']
+
+
+# variables, conditions and options whose output depends on the other cites in
+# the document instead of only on the rendered reference (year-suffix is not
+# generated but taken from the reference, so it is covered by its fingerprint)
+DOCUMENT_VARIABLES = {'citation-number', 'first-reference-note-number'}
+DOCUMENT_CONDITIONS = ('position', 'disambiguate')
+DOCUMENT_OPTIONS = ('subsequent-author-substitute', 'et-al-subsequent-min',
+                    'et-al-subsequent-use-first')
+
+
+class RenderCache(object):
+    """Cache of rendered citations and bibliography entries, holding at most
+    `maxsize` items and discarding the least recently used ones
+
+    Pass it to :class:`CitationStylesBibliography`; it can be shared by
+    bibliographies using different styles, locales and formatters. `hits`
+    and `misses` count the lookups.
+
+    Other storage backends subclass this and override :meth:`_lookup`,
+    :meth:`put` and :meth:`clear` (see :class:`SQLiteRenderCache`)."""
+    def __init__(self, maxsize=4096):
+        self.entries = LRUCache(maxsize)
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        value = self._lookup(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def _lookup(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, value):
+        self.entries.put(key, value)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
+
+
+class SQLiteRenderCache(RenderCache):
+    """Render cache stored in the SQLite database file `filename`, which can
+    be shared by several processes (it is opened in WAL mode)
+
+    Once the rendered output stored exceeds `max_bytes`, the entries stored
+    longest ago are removed. The most recently used entries are also kept in
+    memory (at most `maxsize`). Each process should create its own instance;
+    pickling a SQLiteRenderCache (e.g. to pass it to a worker process)
+    reopens the database. Only use cache files you trust, since the cached
+    output is stored pickled."""
+    # number of stored entries between checks of the database size
+    EVICTION_INTERVAL = 256
+
+    def __init__(self, filename, max_bytes=1 << 28, maxsize=4096,
+                 timeout=30):
+        super(SQLiteRenderCache, self).__init__(maxsize)
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.connection = sqlite3.connect(filename, timeout=timeout)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS entry '
+                                    '(key TEXT PRIMARY KEY, data BLOB NOT NULL,'
+                                    ' size INTEGER NOT NULL,'
+                                    ' stored REAL NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS entry_stored '
+                                    'ON entry (stored)')
+        self._unchecked = 0
+
+    def __reduce__(self):
+        return self.__class__, (self.filename, self.max_bytes,
+                                self.entries.maxsize, self.timeout)
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.filename)
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM entry') \
+                   .fetchone()[0]
+
+    def _lookup(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            row = self.connection.execute('SELECT data FROM entry '
+                                          'WHERE key = ?', (key, )).fetchone()
+            if row is not None:
+                value = pickle.loads(row[0])
+                self.entries.put(key, value)
+        return value
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        """Store the (key, value) pairs in `items` in a single transaction"""
+        rows = []
+        stored = time.time()
+        for key, value in items:
+            self.entries.put(key, value)
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            rows.append((key, data, len(data), stored))
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO entry '
+                                        'VALUES (?, ?, ?, ?)', rows)
+        self._unchecked += len(rows)
+        if self._unchecked >= self.EVICTION_INTERVAL:
+            self.evict()
+
+    def evict(self):
+        """Remove the entries stored longest ago until the total size of the
+        stored entries does not exceed `max_bytes`"""
+        self._unchecked = 0
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM entry WHERE key IN (SELECT key FROM '
+                ' (SELECT key, SUM(size) OVER (ORDER BY stored DESC, rowid DESC)'
+                '  AS total FROM entry) WHERE total > ?)', (self.max_bytes, ))
+
+    def clear(self):
+        super(SQLiteRenderCache, self).clear()
+        with self.connection:
+            self.connection.execute('DELETE FROM entry')
+
+
+def is_cacheable(element):
+    """Whether the output of the style's cs:citation or cs:bibliography
+    `element` depends only on the reference and citation item rendered"""
+    if element is None:
+        return False
+    return not _depends_on_document(element, set())
+
+
+def _depends_on_document(element, visited_macros):
+    for child in element.iter():
+        if any(name in child.attrib for name in DOCUMENT_CONDITIONS
+                                              + DOCUMENT_OPTIONS):
+            return True
+        variables = set(child.get('variable', '').split())
+        if variables & DOCUMENT_VARIABLES:
+            return True
+        macro_name = child.get('macro')
+        if macro_name is not None and macro_name not in visited_macros:
+            visited_macros.add(macro_name)
+            if _depends_on_document(child.get_macro(macro_name),
+                                    visited_macros):
+                return True
+    return False
+
+
+def style_fingerprint(style):
+    """Fingerprint of the style and the locales it uses, and of the
+    citeproc-py version (a persistent cache outlives an upgrade)"""
+    from . import __version__
+
+    digest = sha1(__version__.encode('utf-8'))
+    digest.update(etree.tostring(style.root))
+    for locale in style.root.locales:
+        digest.update(etree.tostring(locale))
+    return digest.hexdigest()
+
+
+def fingerprint(*values):
+    """Stable fingerprint of `values` (references, citation items, strings),
+    identical across processes"""
+    return sha1(repr(_canonical(values)).encode('utf-8')).hexdigest()
+
+
+def _canonical(value):
+    if isinstance(value, dict):
+        items = sorted((str(key), _canonical(item))
+                       for key, item in value.items())
+        if isinstance(value, LiteralDate):
+            items.append(('text', _canonical(value.text)))
+        return type(value).__name__, tuple(items)
+    elif isinstance(value, (list, tuple)):
+        return type(value).__name__, tuple(_canonical(item)
+                                           for item in value)
+    elif isinstance(value, str):
+        return type(value).__name__, str(value)
+    elif isinstance(value, (int, float)) or value is None:
+        return value
+    return type(value).__name__, _canonical(vars(value))
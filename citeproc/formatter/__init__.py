@@ -1,2 +1,16 @@
 
-from . import plain, html, rst
+import unicodedata
+
+
+class Constants(dict):
+    """Unicode characters by name (e.g. 'EN DASH'), passed through the
+    formatter's `preformat` the first time they are looked up"""
+    def __init__(self, preformat):
+        self.preformat = preformat
+
+    def __missing__(self, name):
+        value = self[name] = self.preformat(unicodedata.lookup(name))
+        return value
+
+
+from . import plain, html, rst, tree
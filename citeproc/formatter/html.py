@@ -4,27 +4,35 @@ try:
 except ImportError:
     from cgi import escape
 
+from . import Constants
+
 
 def preformat(text):
     return escape(str(text), quote=False)
 
 
+constants = Constants(preformat)
+
+
 class TagWrapper(str):
     tag = None
     attributes = None
 
-    @classmethod
-    def _wrap(cls, text):
-        if cls.attributes:
-            attrib = ' ' + ' '.join(['{}="{}"'.format(key, value)
-                                     for key, value in cls.attributes.items()])
-        else:
-            attrib = ''
-        return '<{tag}{attrib}>{text}</{tag}>'.format(tag=cls.tag,
-                                                      attrib=attrib,text=text)
+    def __init_subclass__(cls, **kwargs):
+        # the opening and closing tags are built once, for each subclass
+        super(TagWrapper, cls).__init_subclass__(**kwargs)
+        attrib = ''.join([' {}="{}"'.format(key, value)
+                          for key, value in (cls.attributes or {}).items()])
+        cls.open = '<{}{}>'.format(cls.tag, attrib)
+        cls.close = '</{}>'.format(cls.tag)
 
     def __new__(cls, text):
-        return super(TagWrapper, cls).__new__(cls, cls._wrap(text))
+        return super(TagWrapper, cls).__new__(cls,
+                                              cls.open + str(text) + cls.close)
+
+    def __reduce__(self):
+        # the text is wrapped already; don't wrap it again when unpickling
+        return str.__new__, (self.__class__, str(self))
 
 
 class Italic(TagWrapper):
@@ -1,8 +1,14 @@
 
+from . import Constants
+
+
 def preformat(text):
     return text
 
 
+constants = Constants(preformat)
+
+
 Italic = str
 Oblique = str
 Bold = str
@@ -1,4 +1,7 @@
 
+from . import Constants
+
+
 def escape(text):
     text = text.replace('*', r'\*')
     text = text.replace('`', r'\`')
@@ -9,15 +12,22 @@ def preformat(text):
     return escape(str(text))
 
 
+constants = Constants(preformat)
+
+
 class RoleWrapper(str):
     role = None
 
-    @classmethod
-    def _wrap(cls, text):
-        return ':{role}:`{text}`'.format(role=cls.role, text=text)
+    def __init_subclass__(cls, **kwargs):
+        super(RoleWrapper, cls).__init_subclass__(**kwargs)
+        cls.open = ':{}:`'.format(cls.role)
 
     def __new__(cls, text):
-        return super(RoleWrapper, cls).__new__(cls, cls._wrap(text))
+        return super(RoleWrapper, cls).__new__(cls, cls.open + str(text) + '`')
+
+    def __reduce__(self):
+        # the text is wrapped already; don't wrap it again when unpickling
+        return str.__new__, (self.__class__, str(self))
 
 
 class Italic(RoleWrapper):
@@ -0,0 +1,170 @@
+"""Formatter that defers markup until after rendering.
+
+Formatted text is represented by :class:`Span` objects, which behave as their
+plain text in the renderer's string operations while keeping track of their
+(styled) children. The resulting tree of spans can be inspected directly or
+converted to the output of any other formatter with :func:`serialize`.
+"""
+
+from . import Constants
+from ..string import (String, MixedString, Elided, discard_empty_other,
+                      _strip_first_char)
+
+
+class Preformatted(String):
+    """Text that the eager formatters pass through their `preformat` (terms,
+    constants, ...); :func:`serialize` escapes only this text"""
+
+
+def preformat(text):
+    return Preformatted(text)
+
+
+constants = Constants(preformat)
+
+
+def _apply(text, method, *args):
+    if not isinstance(text, (String, MixedString, Span)):
+        text = String(text)
+    return getattr(text, method)(*args)
+
+
+class Span(object):
+    """Text styled using the formatter wrapper named `style`. Unlike the eager
+    formatters' wrappers, a span does not copy its text (`children`), which
+    is only joined into a string when needed."""
+    __slots__ = ('children', )
+    style = None
+
+    def __init__(self, text):
+        self.children = text
+
+    def __reduce__(self):
+        return self.__class__, (self.children, )
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.children)
+
+    def __str__(self):
+        return str(self.children)
+
+    def __bool__(self):
+        return bool(self.children)
+
+    def __getitem__(self, index):
+        return str(self)[index]
+
+    @discard_empty_other
+    def __radd__(self, other):
+        return MixedString([other]).__add__(self)
+
+    @discard_empty_other
+    def __add__(self, other):
+        return MixedString([self]).__add__(other)
+
+    def __iadd__(self, other):
+        return self.__add__(other)
+
+    def _map(self, method, *args):
+        return self.__class__(_apply(self.children, method, *args))
+
+    def replace(self, *args):
+        return self._map('replace', *args)
+
+    def translate(self, table):
+        return self._map('translate', table)
+
+    def rstrip(self, *args):
+        return self._map('rstrip', *args)
+
+    def lower(self):
+        return self._map('lower')
+
+    def upper(self):
+        return self._map('upper')
+
+    def title(self):
+        return self._map('title')
+
+    def soft_lower(self):
+        return self._map('soft_lower')
+
+    def soft_upper(self):
+        return self._map('soft_upper')
+
+    def capitalize_first(self):
+        return self._map('capitalize_first')
+
+    def split(self, *args, **kwargs):
+        return str(self).split(*args, **kwargs)
+
+    def isupper(self):
+        return str(self).isupper()
+
+    def islower(self):
+        return str(self).islower()
+
+    def words(self):
+        # the words of spanned text are not processed individually
+        for word in self.split():
+            yield String(word)
+
+    def strip_first_char(self, styles=()):
+        return self.__class__(_strip_first_char(self.children, styles))
+
+
+class Italic(Span):
+    style = 'Italic'
+
+
+class Oblique(Span):
+    style = 'Oblique'
+
+
+class Bold(Span):
+    style = 'Bold'
+
+
+class Light(Span):
+    style = 'Light'
+
+
+class Underline(Span):
+    style = 'Underline'
+
+
+class Superscript(Span):
+    style = 'Superscript'
+
+
+class Subscript(Span):
+    style = 'Subscript'
+
+
+class SmallCaps(Span):
+    style = 'SmallCaps'
+
+
+def serialize(text, formatter):
+    """Convert `text`, possibly containing spans, to the output of
+    `formatter` (e.g. :mod:`citeproc.formatter.html`), as rendering with
+    `formatter` directly would produce. Only the :class:`Preformatted` text is
+    passed through the formatter's `preformat` (escaping); reference fields
+    and affixes are passed through as-is."""
+    if isinstance(text, Span):
+        wrapper = getattr(formatter, text.style)
+        return wrapper(serialize(text.children, formatter))
+    elif isinstance(text, MixedString):
+        return ''.join([serialize(item, formatter)
+                        for item in list.__iter__(text)])
+    elif isinstance(text, Elided):
+        # dropped by the eager formatters unless markup separates it from the
+        # character it duplicates
+        if any(getattr(formatter, style)('') for style in text.styles):
+            return text.char
+        return ''
+    elif isinstance(text, Preformatted):
+        return formatter.preformat(str(text))
+    elif text is None:
+        return None
+    return str(text)
@@ -1,4 +1,5 @@
 
+import io
 import os
 
 from warnings import warn
@@ -6,8 +7,10 @@ from warnings import warn
 from lxml import etree
 
 from . import SCHEMA_PATH, LOCALES_PATH, STYLES_PATH
-from .model import CitationStylesElement
-from .formatter import html
+from .cache import fingerprint, is_cacheable, style_fingerprint
+from .model import CitationStylesElement, formatting
+from .source import Citation, CitationItem
+from .formatter import html, tree
 
 
 class CitationStylesXML(object):
@@ -105,38 +108,213 @@ class CitationStylesStyle(CitationStylesXML):
     def render_citation(self, citation, cites, callback=None):
         return self.root.citation.render(citation, cites, callback)
 
-    def sort_bibliography(self, citation_items):
-        return self.root.bibliography.sort(citation_items)
+    def sort_bibliography(self, citation_items, top=None):
+        return self.root.bibliography.sort(citation_items, top)
 
     def render_bibliography(self, citation_items):
         return self.root.bibliography.render(citation_items)
 
+    def render_bibliography_entry(self, citation_item):
+        return self.root.bibliography.render_entry(citation_item)
+
 
 class CitationStylesBibliography(object):
-    def __init__(self, style, source, formatter=html):
+    def __init__(self, style, source, formatter=html, cache=None):
         self.style = style
         self.source = source
-        self.formatter = self.style.root.formatter = formatter
+        self.formatter = formatter
+        self.cache = cache
+        self._cacheable = {}
+        self._style_fingerprint = None
+        # only used when rendering through the style's methods directly
+        self.style.root.formatter = formatter
         self.keys = []
         self.items = []
+        # maps each key to its index in keys
+        self.positions = {}
         self._cites = []
 
     def register(self, citation, callback=None):
         citation.bibliography = self
+        self._prefetch([item.key for item in citation.cites])
+        self._register(citation, callback)
+
+    def register_many(self, citations, callback=None):
+        """Register all `citations`, fetching their references from the
+        source in bulk"""
+        citations = list(citations)
+        self._prefetch([item.key for citation in citations
+                        for item in citation.cites])
+        for citation in citations:
+            citation.bibliography = self
+            self._register(citation, callback)
+
+    def register_all(self):
+        """Register every reference in the source, in the source's order (the
+        equivalent of LaTeX's ``\\nocite{*}``)"""
+        for key in self.source:
+            citation = Citation([CitationItem(key)])
+            citation.bibliography = self
+            self._register(citation, None)
+
+    def _prefetch(self, keys):
+        # the source can also be a plain dict
+        prefetch = getattr(self.source, 'prefetch', None)
+        if prefetch is not None:
+            prefetch(keys)
+
+    def _register(self, citation, callback):
         for item in citation.cites:
             if item.key in self.source:
-                if item.key not in self.keys:
+                if item.key not in self.positions:
+                    self.positions[item.key] = len(self.keys)
                     self.keys.append(item.key)
                     self.items.append(item)
             elif callback is not None:
                 callback(item)
 
-    def sort(self):
-        self.items = self.style.sort_bibliography(self.items)
+    def sort(self, top=None):
+        """Sort the bibliography items. If `top` is given, only the first
+        `top` items are put in order and moved to the front; the others
+        keep their relative order."""
+        with formatting(self.formatter):
+            items = self.style.sort_bibliography(self.items, top)
+        if top is not None:
+            # items are dicts (unhashable)
+            first = set(id(item) for item in items)
+            items = items + [item for item in self.items
+                             if id(item) not in first]
+        self.items = items
         self.keys = [item.key for item in self.items]
+        self.positions = {key: index for index, key in enumerate(self.keys)}
 
     def cite(self, citation, callback):
-        return self.style.render_citation(citation, self._cites, callback)
+        return self._render_citation(citation, self._cites, callback)
+
+    def bibliography(self, start=None, stop=None):
+        """Render the bibliography entries, or only the items in the
+        [`start`:`stop`] slice"""
+        return list(self.iter_bibliography(start, stop))
+
+    def iter_bibliography(self, start=None, stop=None):
+        """Generate the bibliography entries one at a time"""
+        for item in self.items[start:stop]:
+            entry = self._render_entry(item)
+            if entry is not None:
+                yield entry
+
+    def _render_citation(self, citation, cites, callback, formatter=None):
+        formatter = formatter or self.formatter
+        key = self._cache_key('citation', citation, formatter)
+        text = None if key is None else self.cache.get(key)
+        if text is not None:
+            cites.append(citation.cites[0])
+            return text
+        with formatting(formatter):
+            text = self.style.render_citation(citation, cites, callback)
+        if key is not None and text is not None:
+            self.cache.put(key, text)
+        return text
+
+    def _render_entry(self, item, formatter=None):
+        formatter = formatter or self.formatter
+        key = self._cache_key('bibliography', item, formatter)
+        entry = None if key is None else self.cache.get(key)
+        if entry is None:
+            with formatting(formatter):
+                entry = self.style.render_bibliography_entry(item)
+            if key is not None and entry is not None:
+                self.cache.put(key, entry)
+        return entry
+
+    def _cache_key(self, kind, citation_or_item, formatter):
+        """Return the render cache key for a citation or bibliography entry,
+        or None if it is not to be cached (because its output depends on
+        the other cites in the document)"""
+        if self.cache is None:
+            return None
+        if kind not in self._cacheable:
+            element = getattr(self.style.root, kind)
+            self._cacheable[kind] = is_cacheable(element)
+            if self._style_fingerprint is None:
+                self._style_fingerprint = style_fingerprint(self.style)
+        if not self._cacheable[kind]:
+            return None
+        if kind == 'citation':
+            citation = citation_or_item
+            if len(citation.cites) != 1 or citation.cites[0].is_bad():
+                return None
+            item, = citation.cites
+            options = [{name: value for name, value in citation.items()
+                        if name not in ('cites', 'bibliography')},
+                       {name: value for name, value in item.items()
+                        if name != 'citation'}]
+        else:
+            item, options = citation_or_item, []
+        formatter_name = getattr(formatter, '__name__', repr(formatter))
+        return fingerprint(self._style_fingerprint, formatter_name, kind,
+                           item.reference, *options)
+
+    def iter_references(self, citations=True, entries=True, start=None,
+                        stop=None):
+        """Generate a dict for each registered item (or those in the
+        [`start`:`stop`] slice) holding its key ('id') and, if requested, its
+        citation as if cited for the first time ('citation') and its
+        bibliography entry ('bibliography')"""
+        for item in self.items[start:stop]:
+            record = dict(id=item.key)
+            if citations:
+                citation = Citation([CitationItem(item.key)])
+                citation.bibliography = self
+                text = self._render_citation(citation, [], None)
+                record['citation'] = str(text)
+            if entries:
+                text = self._render_entry(item)
+                record['bibliography'] = None if text is None else str(text)
+            yield record
+
+    def write_bibliography(self, fp, entry='{}\n', header='', footer='',
+                           encoding='utf-8'):
+        """Write the bibliography entries to the text or binary file object
+        `fp` as they are rendered, each formatted using the `entry` format
+        string and enclosed by `header` and `footer`. For example, for HTML
+        output::
+
+            bibliography.write_bibliography(
+                fp, entry='  <div class="csl-entry">{}</div>\n',
+                header='<div class="csl-bib-body">\n', footer='</div>\n')
+
+        Returns the number of entries written."""
+        binary = isinstance(fp, (io.RawIOBase, io.BufferedIOBase))
+        out = io.TextIOWrapper(fp, encoding=encoding) if binary else fp
+        count = 0
+        try:
+            out.write(header)
+            for count, text in enumerate(self.iter_bibliography(), start=1):
+                out.write(entry.format(text))
+            out.write(footer)
+        finally:
+            if binary:      # don't let the wrapper close `fp`
+                out.flush()
+                out.detach()
+        return count
+
+    def cite_formats(self, citation, callback, formatters):
+        """Return `citation` rendered in the output format of each of
+        `formatters`, as :meth:`cite` would with these formatters. The
+        citation is rendered only once, using the :mod:`.formatter.tree`
+        formatter, and then serialized for each of `formatters`."""
+        text = self._render_citation(citation, self._cites, callback, tree)
+        return [str(tree.serialize(text, formatter))
+                for formatter in formatters]
 
-    def bibliography(self):
-        return self.style.render_bibliography(self.items)
+    def bibliography_formats(self, formatters):
+        """Return the bibliography entries rendered in the output format of
+        each of `formatters`, as :meth:`bibliography` would with these
+        formatters. Like :meth:`cite_formats`, each entry is rendered only
+        once."""
+        entries = [entry for entry in (self._render_entry(item, tree)
+                                       for item in self.items)
+                   if entry is not None]
+        return [[str(tree.serialize(entry, formatter)) for entry in entries]
+                for formatter in formatters]
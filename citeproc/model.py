@@ -1,8 +1,11 @@
 
+import heapq
 import re
 import unicodedata
 import os
 
+from contextlib import contextmanager
+from contextvars import ContextVar
 from functools import cmp_to_key
 from glob import glob
 from operator import itemgetter
@@ -14,6 +17,22 @@ from .source import VariableError, DateRange, LiteralDate
 from .string import String, join, normalize_seam
 
 
+# The output formatter used by the rendering in progress. Keeping it in the
+# context instead of on the style lets one style serve several formatters, also
+# from different threads or tasks.
+current_formatter = ContextVar('current_formatter', default=None)
+
+
+@contextmanager
+def formatting(formatter):
+    """Render using `formatter` within the with-block"""
+    token = current_formatter.set(formatter)
+    try:
+        yield formatter
+    finally:
+        current_formatter.reset(token)
+
+
 # Base class
 
 class SomewhatObjectifiedElement(etree.ElementBase):
@@ -80,7 +99,10 @@ class CitationStylesElement(SomewhatObjectifiedElement):
         return self.xpath_search('./ancestor-or-self::cs:layout[1]')[0]
 
     def get_formatter(self):
-        if isinstance(self.get_root(), Locale):
+        formatter = current_formatter.get()
+        if formatter is not None:
+            return formatter
+        elif isinstance(self.get_root(), Locale):
             return self.get_root().style.formatter
         else:
             return self.get_root().formatter
@@ -88,8 +110,17 @@ class CitationStylesElement(SomewhatObjectifiedElement):
     def preformat(self, text):
         return self.get_formatter().preformat(text)
 
+    def preformat_string(self, text):
+        text = self.preformat(text)
+        # keep the String subclass marking text the tree formatter preformatted
+        return text if isinstance(text, String) else String(text)
+
     def unicode_character(self, name):
-        return self.preformat(unicodedata.lookup(name))
+        formatter = self.get_formatter()
+        try:
+            return formatter.constants[name]
+        except AttributeError:      # formatter without a constants table
+            return formatter.preformat(unicodedata.lookup(name))
 
     def render(self, *args, **kwargs):
         return self.markup(self.process(*args, **kwargs))
@@ -268,12 +299,15 @@ class Bibliography(FormattingInstructions, CitationStylesElement):
                         # reference grouping
                         'subsequent-author-substitute': None}
 
-    def sort(self, citation_items):
-        return self.layout.sort_bibliography(citation_items)
+    def sort(self, citation_items, top=None):
+        return self.layout.sort_bibliography(citation_items, top)
 
     def render(self, citation_items):
         return self.layout.render_bibliography(citation_items)
 
+    def render_entry(self, item):
+        return self.layout.render_bibliography_entry(item)
+
 
 # Style behavior
 
@@ -440,8 +474,7 @@ class Term(CitationStylesElement):
             text = self.find('cs:single', self.nsmap).text
         except AttributeError:
             text = self.text
-        text = self.preformat(text or '')
-        return String(text)
+        return self.preformat_string(text or '')
 
     @property
     def multiple(self):
@@ -449,14 +482,13 @@ class Term(CitationStylesElement):
             text = self.find('cs:multiple', self.nsmap).text
         except AttributeError:
             text = self.text
-        text = self.preformat(text or '')
-        return String(text)
+        return self.preformat_string(text or '')
 
 
 # Sorting elements
 
 class Sort(CitationStylesElement):
-    def sort(self, items, context):
+    def sort(self, items, context, top=None):
         # custom sort function to push items with None keys to bottom
         def multi_key_sort(items, keys, descending):
             lst = zip(items, *keys)
@@ -488,7 +520,10 @@ class Sort(CitationStylesElement):
                 else:
                     return 0
 
-            sorted_lst = sorted(lst, key=cmp_to_key(mycmp))
+            if top is None:
+                sorted_lst = sorted(lst, key=cmp_to_key(mycmp))
+            else:   # only the first `top` items
+                sorted_lst = heapq.nsmallest(top, lst, key=cmp_to_key(mycmp))
             return [item[0] for item in sorted_lst]
 
         sort_descending = []
@@ -633,7 +668,7 @@ class Layout(CitationStylesElement, Parent, Formatted, Affixed, Delimited):
         bibliography = citation.bibliography
         good_cites = [cite for cite in citation.cites if not cite.is_bad()]
         bad_cites = [cite for cite in citation.cites if cite.is_bad()]
-        good_cites.sort(key=lambda item: bibliography.keys.index(item.key))
+        good_cites.sort(key=lambda item: bibliography.positions[item.key])
         # sort using citation/sort element
         if self.getparent().sort is not None:
             good_cites = self.getparent().sort.sort(good_cites, self)
@@ -655,21 +690,24 @@ class Layout(CitationStylesElement, Parent, Formatted, Affixed, Delimited):
             out.append(callback_value or '{}?'.format(item.key))
         return self.format(self.wrap(self.join(out)))
 
-    def sort_bibliography(self, citation_items):
+    def sort_bibliography(self, citation_items, top=None):
         sort = self.getparent().find('cs:sort', self.nsmap)
         if sort is not None:
-            citation_items = sort.sort(citation_items, self)
+            citation_items = sort.sort(citation_items, self, top)
         return citation_items
 
     def render_bibliography(self, citation_items):
         output_items = []
         for item in citation_items:
-            self.repressed = {}
-            text = self.format(self.wrap(self.render_children(item)))
+            text = self.render_bibliography_entry(item)
             if text is not None:
                 output_items.append(text)
         return output_items
 
+    def render_bibliography_entry(self, item):
+        self.repressed = {}
+        return self.format(self.wrap(self.render_children(item)))
+
 
 class FormatNumber(object):
     def _process(self, value, variable):
@@ -762,7 +800,7 @@ class Text(CitationStylesElement, FormatNumber, Formatted, Affixed, Quoted,
         elif 'term' in self.attrib:
             text = self._term(item)
         elif 'value' in self.attrib:
-            text = String(self.preformat(self.get('value')))
+            text = self.preformat_string(self.get('value'))
 
         return text, language
 
@@ -1223,12 +1261,12 @@ class Name(CitationStylesElement, Formatted, Affixed, Delimited):
 
                         given, family = format_name_parts(given, family)
                         order = family, given, suffix
-                        text = sort_separator.join([n for n in order if n])
+                        text = join([n for n in order if n], sort_separator)
                     else:
                         family = ' '.join([n for n in (dp, ndp, family) if n])
                         given, family = format_name_parts(given, family)
                         order = given, family, suffix
-                        text = ' '.join([n for n in order if n])
+                        text = join([n for n in order if n], ' ')
                 elif form == 'short':
                     family = ' '.join([n for n in (ndp, family) if n])
                     given, family = format_name_parts(given, family)
@@ -1256,7 +1294,7 @@ class Name(CitationStylesElement, Formatted, Affixed, Delimited):
                         text = self.join([text, ''], ', ')
                 else:
                     text += ' '
-                text += '{} '.format(and_term) + output[-1]
+                text += and_term + ' ' + output[-1]
             else:
                 text = self.join(output, delimiter)
 
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+import json
+import os
+import sys
+import warnings
+
+from concurrent.futures import ProcessPoolExecutor
+from optparse import OptionParser
+
+from citeproc import CitationStylesStyle, CitationStylesBibliography
+from citeproc import Citation, CitationItem, SQLiteRenderCache
+from citeproc import formatter
+from citeproc.source.bibtex import BibTeX
+from citeproc.source.json import CiteProcJSON
+from citeproc.source.sqlite import SQLiteSource
+from citeproc.source.store import StoreSource, SharedMemorySource
+
+
+COMPRESSION_EXTENSIONS = ('.gz', '.bz2', '.xz', '.lzma', '.zst')
+
+
+def open_source(filename, encoding='utf-8'):
+    """Open the bibliography source `filename`, selecting the source class
+    based on its extension (possibly followed by a compression extension)"""
+    name, extension = os.path.splitext(filename.lower())
+    if extension in COMPRESSION_EXTENSIONS:
+        name, extension = os.path.splitext(name)
+    if extension == '.bib':
+        return BibTeX(filename, encoding=encoding)
+    elif extension in ('.json', '.jsonl', '.ndjson'):
+        return CiteProcJSON.from_file(filename, encoding=encoding, lazy=True)
+    elif extension in ('.store', '.cslstore'):
+        return StoreSource(filename)
+    elif extension in ('.sqlite', '.sqlite3', '.db'):
+        return SQLiteSource(filename)
+    raise ValueError("unknown bibliography source type: '{}'"
+                     .format(filename))
+
+
+def create_bibliography(style, source, output_format, cache=None, keys=None):
+    """Create a bibliography for `source` using the CitationStylesStyle
+    `style`, with all of its references (or those in `keys`, in that order)
+    registered"""
+    bibliography = CitationStylesBibliography(style, source,
+                                              getattr(formatter, output_format),
+                                              cache=cache)
+    if keys is None:
+        bibliography.register_all()
+    else:
+        bibliography.register_many(Citation([CitationItem(key)])
+                                   for key in keys)
+    return bibliography
+
+
+# each worker process loads the style itself and attaches to the source
+_worker = None
+
+
+def _initialize_worker(style, locale, source, output_format, cache):
+    global _worker
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        _worker = (CitationStylesStyle(style, locale=locale, validate=False),
+                   source, output_format, cache)
+
+
+def _render_chunk(args):
+    start, keys, citations, entries = args
+    style, source, output_format, cache = _worker
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        # only the chunk's references are registered (and fetched); they are
+        # numbered as in the complete bibliography
+        bibliography = create_bibliography(style, source, output_format,
+                                           cache, keys)
+        bibliography.positions = {key: index for index, key
+                                  in enumerate(keys, start)}
+        return [json.dumps(record, ensure_ascii=False)
+                for record in bibliography.iter_references(citations,
+                                                           entries)]
+
+
+def render(bibliography, citations, entries, processes, chunk_size,
+           initargs):
+    """Generate a JSON line for each reference in `bibliography`, rendering
+    chunks of `chunk_size` references in `processes` worker processes
+
+    `initargs` holds the style, locale, output format and render cache the
+    worker processes are initialized with."""
+    if processes == 1:
+        for record in bibliography.iter_references(citations, entries):
+            yield json.dumps(record, ensure_ascii=False)
+        return
+    # the chunks hold the keys in the (possibly sorted) order established
+    # here, so that citation numbers match
+    keys = bibliography.keys
+    chunks = [(start, keys[start:start + chunk_size], citations, entries)
+              for start in range(0, len(keys), chunk_size)]
+    source, shared = bibliography.source, None
+    if not isinstance(source, (StoreSource, SQLiteSource)):
+        # the source was parsed in this process; share a single copy of the
+        # references with the workers (store and SQLite sources are reopened
+        # by the workers when unpickled)
+        source = shared = SharedMemorySource.publish(source)
+    style, locale, output_format, cache = initargs
+    try:
+        with ProcessPoolExecutor(processes, initializer=_initialize_worker,
+                                 initargs=(style, locale, source,
+                                           output_format, cache)) as executor:
+            for lines in executor.map(_render_chunk, chunks):
+                for line in lines:
+                    yield line
+    finally:
+        if shared is not None:
+            shared.unlink()
+
+
+def main(argv=None):
+    usage = \
+"""usage: %prog [options] <source_file>
+
+Render every reference in <source_file> (BibTeX, CSL-JSON, reference store or
+SQLite database, possibly compressed) and write a JSON object for each of them
+to stdout, one per line: {"id": ..., "citation": ..., "bibliography": ...}
+"""
+    parser = OptionParser(usage)
+    parser.add_option('-s', '--style', dest='style',
+                      default='harvard-cite-them-right',
+                      help='style name or file', metavar='STYLE')
+    parser.add_option('-l', '--locale', dest='locale', default=None,
+                      help='locale (default: the style\'s default locale)')
+    parser.add_option('-f', '--format', dest='format', default='plain',
+                      help='output format: plain, html or rst')
+    parser.add_option('-e', '--encoding', dest='encoding', default='utf-8',
+                      help='encoding of BibTeX and CSL-JSON source files')
+    parser.add_option('-o', '--output', dest='output', default=None,
+                      help='output file (default: stdout)', metavar='FILE')
+    parser.add_option('--sort', dest='sort', action='store_true',
+                      default=False,
+                      help='sort the references as in the bibliography')
+    parser.add_option('--no-citations', dest='citations',
+                      action='store_false', default=True,
+                      help='do not render citations')
+    parser.add_option('--no-bibliography', dest='entries',
+                      action='store_false', default=True,
+                      help='do not render bibliography entries')
+    parser.add_option('-j', '--processes', dest='processes', type='int',
+                      default=1,
+                      help='number of worker processes (0: one per CPU)')
+    parser.add_option('--chunk-size', dest='chunk_size', type='int',
+                      default=1000,
+                      help='references rendered by a worker at a time')
+    parser.add_option('--cache', dest='cache', default=None,
+                      help='look up and store the rendered output in this '
+                           'SQLite render cache file (shared by the worker '
+                           'processes); rendering all references with only '
+                           'this option set warms up the cache',
+                      metavar='FILE')
+    parser.add_option('--cache-size', dest='cache_size', type='int',
+                      default=1 << 28,
+                      help='maximum size of the cached output in bytes',
+                      metavar='BYTES')
+    (options, args) = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.print_usage()
+        sys.exit(1)
+    if options.format not in ('plain', 'html', 'rst'):
+        parser.error("format should be one of: plain, html, rst")
+
+    cache = (SQLiteRenderCache(options.cache, max_bytes=options.cache_size)
+             if options.cache else None)
+    initargs = (options.style, options.locale, options.format, cache)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        style = CitationStylesStyle(options.style, locale=options.locale,
+                                    validate=False)
+        source = open_source(args[0], options.encoding)
+        bibliography = create_bibliography(style, source, options.format,
+                                           cache)
+        if options.sort:
+            bibliography.sort()
+        lines = render(bibliography, options.citations, options.entries,
+                       options.processes or os.cpu_count(),
+                       options.chunk_size, initargs)
+        output = (open(options.output, 'w', encoding='utf-8')
+                  if options.output else sys.stdout)
+        try:
+            for line in lines:
+                output.write(line + '\n')
+        finally:
+            if options.output:
+                output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -43,7 +43,8 @@ environment variable with something like (bash shell)::
         output_format = getattr(formatter, options.format)
     except AttributeError:
         available_formatters = (attr for attr in dir(formatter)
-                                if not attr.startswith('__'))
+                                if hasattr(getattr(formatter, attr),
+                                           'preformat'))
         print('style should be one of: ' + ', '.join(available_formatters))
         sys.exit(1)
 
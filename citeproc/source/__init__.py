@@ -3,13 +3,54 @@
 
 # http://dret.net/bibconvert/tex2unicode
 
+import bz2
+import copyreg
+import gzip
+import io
+import lzma
+
+from collections import Counter, OrderedDict
 from warnings import warn
 
+try:
+    from compression import zstd        # Python 3.14+
+except ImportError:
+    zstd = None
+
 from .. import VARIABLES
 
 
+# magic bytes identifying compressed files
+COMPRESSION_FORMATS = [(b'\x1f\x8b', gzip.open),
+                       (b'BZh', bz2.open),
+                       (b'\xfd7zXZ\x00', lzma.open),
+                       (b']\x00\x00', lzma.open)]     # legacy .lzma
+if zstd is not None:
+    COMPRESSION_FORMATS.append((b'\x28\xb5\x2f\xfd', zstd.open))
+
+
+def open_text(filename, encoding, seekable=False):
+    """Open the file `filename` for reading text, decompressing it while
+    reading if it is compressed (gzip, bzip2, xz/lzma or Zstandard), as
+    determined from its first bytes.
+
+    Seeking in a compressed file is very slow, so with `seekable`, a
+    compressed file is decompressed to memory up front."""
+    with open(filename, 'rb') as file:
+        magic = file.read(8)
+    for signature, open_compressed in COMPRESSION_FORMATS:
+        if magic.startswith(signature):
+            file = open_compressed(filename, 'rt', encoding=encoding)
+            if seekable:
+                with file:
+                    return io.StringIO(file.read())
+            return file
+    return open(filename, 'rt', encoding=encoding)
+
+
 class CustomDict(dict):
-    def __init__(self, args, required=set(), optional=set(), required_or=[]):
+    def __init__(self, args, required=set(), optional=set(), required_or=[],
+                 diagnostics=None):
         passed_keywords = set(args.keys())
         missing = required - passed_keywords
         if missing:
@@ -24,14 +65,23 @@ class CustomDict(dict):
         unsupported = passed_keywords - required - optional - required_or_merged
         if unsupported:
             cls_name = self.__class__.__name__
-            warn('The following arguments for {} are '.format(cls_name) +
-                 'unsupported: ' + ', '.join(unsupported))
+            if diagnostics is not None:
+                key = dict.get(self, 'key')
+                for argument in unsupported:
+                    diagnostics.record('unsupported argument',
+                                       '{}.{}'.format(cls_name, argument), key)
+            else:
+                warn('The following arguments for {} are '.format(cls_name) +
+                     'unsupported: ' + ', '.join(unsupported))
         self.update(args)
 
     def __setattr__(self, name, value):
         self[name] = value
 
     def __getattr__(self, name):
+        if name.startswith('__'):
+            # special methods looked up by pickle and copy are not variables
+            raise AttributeError(name)
         return self[name]
 
     def __getitem__(self, key):
@@ -42,18 +92,55 @@ class CustomDict(dict):
 
 
 class Reference(CustomDict):
-    def __init__(self, key, type, **args):
+    def __init__(self, key, type, diagnostics=None, **args):
         self.key = key
         self.type = type
         #required_or = [set(csl.VARIABLES)]
         optional = ({'uri', 'container_uri', 'contributor', 'date'} |
                     set(VARIABLES))
-        super(Reference, self).__init__(args, optional=optional)
+        super(Reference, self).__init__(args, optional=optional,
+                                        diagnostics=diagnostics)
 
     def __repr__(self):
         return '{}({})'.format(self.__class__.__name__, self.key)
 
 
+class LazyReference(Reference):
+    """Reference that holds the raw field values and converts each of them
+    with `convert(variable, raw_value)` the first time it is accessed.
+
+    Membership tests (`variable in reference`) do not trigger a conversion."""
+    def __init__(self, key, type, convert, diagnostics=None, **args):
+        object.__setattr__(self, '_convert', convert)
+        object.__setattr__(self, '_pending', set(args))
+        super(LazyReference, self).__init__(key, type, diagnostics, **args)
+
+    def __getitem__(self, key):
+        value = super(LazyReference, self).__getitem__(key)
+        if key in self._pending:
+            value = self._convert(key, value)
+            dict.__setitem__(self, key, value)
+            self._pending.discard(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._pending.discard(key)
+        super(LazyReference, self).__setitem__(key, value)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def __reduce__(self):
+        # pickled as a plain Reference; this drops the link to the source
+        return Reference.__new__, (Reference, ), None, None, iter(self.items())
+
+
 class VariableError(Exception):
     pass
 
@@ -136,6 +223,14 @@ class DateRange(DateBase):
         raise NotImplementedError
 
 
+def _shallow_copy(obj):
+    # copy.copy would otherwise use __reduce__, which drops the links that
+    # pickling rebuilds; a shallow copy shares them with the original
+    copy = obj.__class__.__new__(obj.__class__)
+    dict.update(copy, obj)
+    return copy
+
+
 class Citation(CustomDict):
     def __init__(self, cites, **kwargs):
         for cite in cites:
@@ -143,6 +238,20 @@ class Citation(CustomDict):
         self.cites = cites
         super(Citation, self).__init__(kwargs)
 
+    def __reduce__(self):
+        # don't pickle the bibliography this citation is registered with;
+        # __setstate__ links the cites back to the citation
+        items = dict(self)
+        items.pop('bibliography', None)
+        return (copyreg.__newobj__, (self.__class__, ), self.cites, None,
+                iter(items.items()))
+
+    def __setstate__(self, cites):
+        for cite in cites:
+            cite.citation = self
+
+    __copy__ = _shallow_copy
+
     def __repr__(self):
         cites = ', '.join([cite.key for cite in self.cites])
         return '{}({})'.format(self.__class__.__name__, cites)
@@ -154,6 +263,15 @@ class CitationItem(CustomDict):
         optional = {'locator', 'prefix', 'suffix'}
         super(CitationItem, self).__init__(args, optional=optional)
 
+    def __reduce__(self):
+        # the link to the citation is restored by Citation.__setstate__
+        items = dict(self)
+        items.pop('citation', None)
+        return (copyreg.__newobj__, (self.__class__, ), None, None,
+                iter(items.items()))
+
+    __copy__ = _shallow_copy
+
     def __repr__(self):
         return '{}({})'.format(self.__class__.__name__, self.key)
 
@@ -167,7 +285,7 @@ class CitationItem(CustomDict):
 
     @property
     def number(self):
-        return self.bibliography.keys.index(self.key) + 1
+        return self.bibliography.positions[self.key] + 1
 
     @property
     def has_locator(self):
@@ -179,7 +297,7 @@ class CitationItem(CustomDict):
             return self.bibliography.formatter.preformat(string)
 
     def is_bad(self):
-        return self.key not in self.bibliography.keys
+        return self.key not in self.bibliography.positions
 
 
 class Locator(object):
@@ -189,8 +307,142 @@ class Locator(object):
 
 
 class BibliographySource(dict):
+    intern_pool = None
+    diagnostics = None
+
     def add(self, entry):
         self[entry.key] = entry
 
+    def get_many(self, keys):
+        """Return a dict mapping those of `keys` present in this source to
+        their references"""
+        return {key: self[key] for key in keys if key in self}
+
+    def prefetch(self, keys):
+        """Hint that the references for `keys` will be looked up soon.
+
+        Sources with a per-lookup overhead override this to fetch the
+        references in bulk; for in-memory sources, this does nothing."""
+        pass
+
+    def intern(self, kind, raw, factory):
+        """Return `factory(raw)`, or an equal object created earlier for the
+        same `raw` value if this source uses an intern pool"""
+        if self.intern_pool is None:
+            return factory(raw)
+        return self.intern_pool.intern(kind, raw, factory)
+
+
+class InternPool(object):
+    """Pool of shared objects for the values that occur repeatedly in large
+    bibliographies, such as author names, journal titles and publishers.
+
+    Bibliography sources created with the same pool share these objects.
+    Interned objects are shared between references and must not be modified.
+    """
+    # string variables whose values are interned; other strings (titles,
+    # abstracts, ...) are rarely repeated
+    fields = {'archive', 'archive_place', 'authority', 'collection_title',
+              'container_title', 'container_title_short', 'event',
+              'event_place', 'genre', 'jurisdiction', 'language', 'medium',
+              'original_publisher', 'original_publisher_place', 'publisher',
+              'publisher_place', 'source', 'status'}
+
+    def __init__(self, fields=None):
+        if fields is not None:
+            self.fields = set(fields)
+        self.objects = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.objects)
+
+    def intern(self, kind, raw, factory):
+        try:
+            result = self.objects[kind, raw]
+        except KeyError:
+            result = self.objects[kind, raw] = factory(raw)
+            self.misses += 1
+        except TypeError:   # unhashable raw value
+            return factory(raw)
+        else:
+            self.hits += 1
+        return result
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class Diagnostics(object):
+    """Collects the problems found while loading bibliography sources, such
+    as unsupported fields or entry types, instead of issuing a warning for
+    each occurrence.
+
+    `counts` maps each (category, name) pair to its number of occurrences and
+    `samples` maps it to the keys of (at most `max_samples`) references in
+    which it occurred.
+    """
+    def __init__(self, max_samples=5):
+        self.max_samples = max_samples
+        self.counts = Counter()
+        self.samples = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def record(self, category, name, key=None):
+        problem = category, name
+        self.counts[problem] += 1
+        samples = self.samples.setdefault(problem, [])
+        if key is not None and len(samples) < self.max_samples:
+            samples.append(key)
+
+    def summary(self):
+        """Return a report listing the problems, most frequent first"""
+        lines = []
+        for (category, name), count in self.counts.most_common():
+            line = '{} {!r}: {}'.format(category, name, count)
+            samples = self.samples[category, name]
+            if samples:
+                line += ' (e.g. {})'.format(', '.join(samples))
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+class LRUCache(object):
+    """Mapping that holds at most `maxsize` items, discarding the least
+    recently used item when full"""
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, default=None):
+        try:
+            self.items.move_to_end(key)
+        except KeyError:
+            return default
+        return self.items[key]
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self.items.pop(key, default)
+
+    def clear(self):
+        self.items.clear()
+
 
 from . import bibtex, json
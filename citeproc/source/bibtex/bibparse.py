@@ -2,6 +2,9 @@
 # http://maverick.inria.fr/~Xavier.Decoret/resources/xdkbibtex/bibtex_summary.html
 # http://www.lsv.ens-cachan.fr/~markey/bibla.php?lang=en
 
+from .. import open_text
+
+
 class BibTeXEntry(dict):
     def __init__(self, document_type, attributes):
         super(BibTeXEntry, self).__init__(attributes)
@@ -34,12 +37,12 @@ class BibTeXParser(dict):
                           'nov': 'November',
                           'dec': 'December'}
 
-    def __init__(self, file_or_filename, encoding='ascii'):
+    def __init__(self, file_or_filename, encoding='ascii', variables=None):
         try:
-            self.file = open(file_or_filename, 'rt', encoding=encoding)
+            self.file = open_text(file_or_filename, encoding, seekable=True)
         except TypeError:
             self.file = file_or_filename
-        self.variables = {}
+        self.variables = dict(variables) if variables else {}
         self.preamble = ''
         self._parse(self.file)
         self.file.close()
@@ -1,5 +1,10 @@
 ﻿
+import hashlib
+import io
+import os
+import pickle
 import re
+import tempfile
 import unicodedata
 
 from warnings import warn
@@ -8,6 +13,7 @@ from ...types import (ARTICLE, ARTICLE_JOURNAL, BOOK, CHAPTER, MANUSCRIPT,
                       PAMPHLET, PAPER_CONFERENCE, REPORT, THESIS)
 from ...string import String, MixedString, NoCase
 from .. import BibliographySource, Reference, Name, Date, DateRange
+from .. import open_text
 from .bibparse import BibTeXParser
 from .latex import parse_latex
 from .latex.macro import NewCommand, Macro
@@ -65,17 +71,185 @@ class BibTeX(BibliographySource):
              'report': REPORT,
              }
 
-    def __init__(self, filename, encoding='ascii'):
-        bibtex_database = BibTeXParser(filename, encoding)
+    def __init__(self, filename, encoding='ascii', cache_dir=None,
+                 watch=False, intern_pool=None, diagnostics=None):
+        self.filename = filename
+        self.encoding = encoding
+        self.intern_pool = intern_pool
+        self.diagnostics = diagnostics
+        self._chunks = None
+        if watch:
+            text = self._read()
+            self._set_index(*self._index(text))
+            filename = io.StringIO(text)
+        cache_path = None
+        # references loaded from the cache are not interned and no
+        # diagnostics are collected for them, so don't use the cache then
+        if (cache_dir is not None and not hasattr(self.filename, 'read')
+                and intern_pool is None and diagnostics is None):
+            cache_path = self._cache_path(self.filename, encoding, cache_dir)
+            if self._load_cache(cache_path):
+                return
+        self._load(BibTeXParser(filename, encoding))
+        if cache_path is not None:
+            self._store_cache(cache_path)
+
+    def _load(self, bibtex_database):
         self.preamble_macros = {}
+        self.variables = bibtex_database.variables
         parse_latex(bibtex_database.preamble,
                     {'newcommand': NewCommand(self.preamble_macros),
                      'mbox': Macro(1, '{0}'),
                      'cite': Macro(1, 'CITE({0})')})
         for key, entry in bibtex_database.items():
-            self.add(self.create_reference(key, entry))
+            self._add_entry(key, entry)
+
+    def intern(self, kind, raw, factory):
+        # the decoded value depends on the macros defined in the preamble
+        # (these hash by identity, so sources with macros never share values)
+        kind = kind, tuple(self.preamble_macros.items())
+        return super(BibTeX, self).intern(kind, raw, factory)
+
+    def _add_entry(self, key, entry):
+        reference = self.create_reference(key, entry)
+        if reference is not None:
+            self.add(reference)
+
+    # conversion cache
+    #
+    # The converted references are pickled to a file in `cache_dir` whose name
+    # is derived from the contents of the BibTeX file, the encoding and the
+    # citeproc-py version. A modified database file thus maps onto a different
+    # cache file, triggering a rebuild.
 
-    def _bibtex_to_csl(self, bibtex_entry):
+    @staticmethod
+    def _cache_path(filename, encoding, cache_dir):
+        from ... import __version__
+
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update('\0{}\0{}'.format(encoding, __version__).encode('utf-8'))
+        return os.path.join(cache_dir, digest.hexdigest() + '.pickle')
+
+    def _load_cache(self, cache_path):
+        try:
+            with open(cache_path, 'rb') as file:
+                (self.preamble_macros, self.variables,
+                 references) = pickle.load(file)
+            self.update(references)
+        except Exception:   # missing, truncated or foreign cache file
+            self.clear()
+            return False
+        return True
+
+    def _store_cache(self, cache_path):
+        cache_dir = os.path.dirname(cache_path)
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary file first so that concurrent readers never see
+        # a partially written cache file
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump((self.preamble_macros, self.variables, dict(self)),
+                            file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    # incremental refresh
+    #
+    # The database text is split into chunks, each starting with an '@' at the
+    # start of a line (outside of braces). For every chunk holding regular entries, we remember the
+    # hash of its text along with the keys of the entries it defines. On
+    # refresh, only the chunks whose hash is not known yet need to be parsed
+    # and converted. @string and @preamble chunks can affect every entry, so a
+    # change to these triggers a full reload.
+
+    RE_CHUNK_START = re.compile(r'^[ \t]*@', re.MULTILINE)
+    RE_ENTRY_HEAD = re.compile(r'@\s*(\w+)\s*[{(]\s*([^,\s]*)')
+
+    def _read(self):
+        with open_text(self.filename, self.encoding) as file:
+            return file.read()
+
+    @staticmethod
+    def _outside_braces(regex, text):
+        """Generate the matches of `regex` in `text` that are not enclosed in
+        braces (an '@' inside a field value does not start an entry)"""
+        depth = position = 0
+        for match in regex.finditer(text):
+            between = text[position:match.start()]
+            depth = max(depth + between.count('{') - between.count('}'), 0)
+            position = match.start()
+            if depth == 0:
+                yield match
+
+    def _split_chunks(self, text):
+        starts = [match.start() for match
+                  in self._outside_braces(self.RE_CHUNK_START, text)]
+        return [text[start:end]
+                for start, end in zip(starts, starts[1:] + [len(text)])]
+
+    def _index(self, text):
+        """Return a hash of the @string and @preamble chunks in `text`, and a
+        list of (hash, keys, chunk) tuples for the other chunks."""
+        specials = hashlib.sha1()
+        entries = []
+        for chunk in self._split_chunks(text):
+            keys = []
+            for match in self._outside_braces(self.RE_ENTRY_HEAD, chunk):
+                entry_type, key = match.groups()
+                entry_type = entry_type.lower()
+                if entry_type in ('string', 'preamble'):
+                    specials.update(chunk.encode('utf-8'))
+                    break
+                elif entry_type != 'comment':
+                    keys.append(key.lower())
+            else:
+                digest = hashlib.sha1(chunk.encode('utf-8')).digest()
+                entries.append((digest, keys, chunk))
+        return specials.digest(), entries
+
+    def _set_index(self, specials, entries):
+        self._specials = specials
+        self._chunks = {digest: keys for digest, keys, _ in entries}
+
+    def refresh(self):
+        """Re-read the BibTeX database file and update the references that
+        were added, modified or removed since it was last read.
+
+        Only the modified entries are parsed and converted again when the
+        source was created with `watch=True` (and after the first refresh).
+        Returns the set of keys of the references that changed."""
+        text = self._read()
+        specials, entries = self._index(text)
+        if self._chunks is None or specials != self._specials:
+            changed = set(self)
+            self.clear()
+            self._load(BibTeXParser(io.StringIO(text)))
+            changed |= set(self)
+        else:
+            changed = set()
+            current = {digest for digest, _, _ in entries}
+            for digest, keys in self._chunks.items():
+                if digest not in current:
+                    for key in keys:
+                        self.pop(key, None)
+                        changed.add(key)
+            new_text = ''.join(chunk for digest, _, chunk in entries
+                               if digest not in self._chunks)
+            bibtex_database = BibTeXParser(io.StringIO(new_text),
+                                           variables=self.variables)
+            for key, entry in bibtex_database.items():
+                self._add_entry(key, entry)
+                changed.add(key)
+        self._set_index(specials, entries)
+        return changed
+
+    def _bibtex_to_csl(self, bibtex_entry, key=None):
         csl_dict = {}
         for field, value in bibtex_entry.items():
             try:
@@ -85,7 +259,11 @@ class BibTeX(BibliographySource):
             try:
                 csl_field = self.fields[field]
             except KeyError:
-                if field not in ('year', 'month', 'filename'):
+                if field in ('year', 'month', 'filename'):
+                    pass
+                elif self.diagnostics is not None:
+                    self.diagnostics.record('unsupported field', field, key)
+                else:
                     warn("Unsupported BibTeX field '{}'".format(field))
                 continue
             if field in ('number', 'volume'):
@@ -99,7 +277,12 @@ class BibTeX(BibliographySource):
                 value = [name for name in self._parse_author(value)]
             else:
                 try:
-                    value = self._parse_string(value)
+                    if (self.intern_pool is not None
+                            and csl_field in self.intern_pool.fields):
+                        value = self.intern('string', value,
+                                            self._parse_string)
+                    else:
+                        value = self._parse_string(value)
                 except TypeError:
                     value = str(value)
             csl_dict[csl_field] = value
@@ -212,28 +395,38 @@ class BibTeX(BibliographySource):
         return output
 
     def _parse_author(self, authors):
-        csl_authors = []
-        for author in split_names(authors):
-            first, von, last, jr = parse_name(author)
-            csl_parts = {}
-            for part, csl_label in [(first, 'given'),
-                                    (von, 'non-dropping-particle'),
-                                    (last, 'family'),
-                                    (jr, 'suffix')]:
-                if part is not None:
-                    csl_parts[csl_label] = parse_latex(part,
-                                                       self.preamble_macros)
-            name = Name(**csl_parts)
-            csl_authors.append(name)
-        return csl_authors
+        return [self.intern('name', name_parts, self._create_name)
+                for name_parts in parse_names(authors)]
+
+    def _create_name(self, name_parts):
+        first, von, last, jr = name_parts
+        csl_parts = {}
+        for part, csl_label in [(first, 'given'),
+                                (von, 'non-dropping-particle'),
+                                (last, 'family'),
+                                (jr, 'suffix')]:
+            if part is not None:
+                csl_parts[csl_label] = parse_latex(part, self.preamble_macros)
+        return Name(**csl_parts)
 
     def create_reference(self, key, bibtex_entry):
-        csl_type = self.types[bibtex_entry.document_type]
-        csl_fields = self._bibtex_to_csl(bibtex_entry)
+        """Convert `bibtex_entry` to a Reference. When collecting
+        diagnostics, entries of an unsupported type are recorded and None is
+        returned."""
+        try:
+            csl_type = self.types[bibtex_entry.document_type]
+        except KeyError:
+            if self.diagnostics is None:
+                raise
+            self.diagnostics.record('unsupported type',
+                                    bibtex_entry.document_type, key)
+            return None
+        csl_fields = self._bibtex_to_csl(bibtex_entry, key)
         csl_date = self._bibtex_to_csl_date(bibtex_entry)
         if csl_date:
             csl_fields['issued'] = csl_date
-        return Reference(key, csl_type, **csl_fields)
+        return Reference(key, csl_type, diagnostics=self.diagnostics,
+                         **csl_fields)
 
 
 # BibTeX name handling
@@ -248,31 +441,54 @@ class BibTeX(BibliographySource):
 
 AND = ' and '
 
+# ' and ' is matched with a lookahead so that overlapping occurrences are found
+RE_AND_OR_BRACE = re.compile(r'(?= and )|[{}]')
+RE_NAME_DELIMITER = re.compile(r'(?= and )|[{} \t,]')
+RE_WORD_DELIMITER = re.compile(r'[{} \t,]')
+
+
 def split_names(string):
     """Split a string of names separated by 'and' into a list of names."""
     brace_level = 0
     names = []
     last_index = 0
-    for i in range(len(string)):
-        char = string[i]
-        if brace_level == 0 and string[i:].startswith(AND):
-            names.append(string[last_index:i])
-            last_index = i + len(AND)
-        elif char == '{':
+    for match in RE_AND_OR_BRACE.finditer(string):
+        char = match.group()
+        if char == '{':
             brace_level += 1
         elif char == '}':
             brace_level -= 1
+        elif brace_level == 0:
+            names.append(string[last_index:match.start()])
+            last_index = match.start() + len(AND)
     last_name = string[last_index:]
     if last_name:
         names.append(last_name)
     return names
 
 
+def parse_names(string):
+    """Parse a string of names separated by 'and' into a list of (First, von,
+    Last, Jr) tuples.
+
+    This is equivalent to ``[parse_name(name) for name in split_names(string)]``
+    but splits the string into names, parts and words in a single pass.
+    """
+    return [parse_name_parts(parts)
+            for parts in _split_names_and_words(string, RE_NAME_DELIMITER)]
+
+
 def parse_name(name):
     """Parse a BibTeX name string and split it into First, von, Last and Jr
     parts.
     """
-    parts = split_name(name)
+    return parse_name_parts(split_name(name))
+
+
+def parse_name_parts(parts):
+    """Split the name `parts` as returned by `split_name` into First, von, Last
+    and Jr parts.
+    """
     if len(parts) == 1:       # First von Last
         first_von_last, = parts
         index = 0
@@ -299,29 +515,59 @@ def split_name(name):
 
     Returns a list of of lists of words.
     """
-    brace_level = 0
+    parts, = _split_names_and_words(name, RE_WORD_DELIMITER) or [[]]
+    return parts
+
+
+def _split_names_and_words(string, delimiter_regex):
+    """Split `string` into names (if `delimiter_regex` matches ' and '), each
+    name into parts and each part into words.
+
+    Words are slices of `string` between the delimiters found at brace-level
+    0, so the string is only scanned once. Returns a list of names, each a list
+    of parts, each a list of words."""
+    names = []
     parts = []
-    current_part = []
-    word = ''
-    for char in name:
-        if char in ' \t,':
-            if brace_level == 0:
-                if word:
-                    current_part.append(word)
-                    word = ''
-                if char == ',':
-                    parts.append(current_part)
-                    current_part = []
-                continue
-        elif char == '{':
+    words = []
+    brace_level = 0
+    word_start = 0
+    name_start = 0      # delimiters before this index belong to an ' and '
+
+    def end_name(end):
+        # like split_name, drop the last part if it doesn't end in a word
+        word = string[word_start:end]
+        if word:
+            words.append(word)
+            parts.append(words)
+        names.append(parts)
+
+    for match in delimiter_regex.finditer(string):
+        char = match.group()
+        index = match.start()
+        if char == '{':
             brace_level += 1
         elif char == '}':
             brace_level -= 1
-        word += char
-    if word:
-        current_part.append(word)
-        parts.append(current_part)
-    return parts
+        elif brace_level != 0:
+            pass
+        elif not char:                              # ' and '
+            if index < name_start:                  # 'and and': empty name
+                names.append([])
+            else:
+                end_name(index)
+                parts, words = [], []
+            word_start = name_start = index + len(AND)
+        elif index >= name_start:                   # whitespace or comma
+            word = string[word_start:index]
+            if word:
+                words.append(word)
+            if char == ',':
+                parts.append(words)
+                words = []
+            word_start = index + 1
+    if name_start < len(string):
+        end_name(len(string))
+    return names
 
 
 def is_capitalized(string):
@@ -329,14 +575,16 @@ def is_capitalized(string):
 
     A string can be "case-less", in which case `None` is returned.
     """
+    if string[:1].isalpha():
+        return string[0].isupper()
     brace_level = 0
     special_char = False
-    for char, next_char in lookahead_iter(string):
+    for index, char in enumerate(string):
         if (brace_level == 0 or special_char) and char.isalpha():
             return char.isupper()
         elif char == '{':
             brace_level += 1
-            if brace_level == 1 and next_char == '\\':
+            if brace_level == 1 and string[index + 1:index + 2] == '\\':
                 special_char = True
         elif char == '}':
             brace_level -= 1
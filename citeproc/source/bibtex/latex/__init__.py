@@ -1,7 +1,9 @@
 
+import re
 import unicodedata
 
 from collections import namedtuple
+from functools import lru_cache
 from warnings import warn
 
 
@@ -9,11 +11,18 @@ __all__ = ['parse_latex', 'substitute_ligatures']
 
 
 def parse_latex(string, macros={}):
+    # strings without any macros, groups, math or ligatures are returned as-is
+    if not RE_SPECIAL.search(string):
+        return string
+    # the macro table is part of the memoization key; the Macro objects hash
+    # by identity, so a different table never hits the cached results
+    return _parse_latex(string, tuple(macros.items()))
+
+
+@lru_cache(maxsize=4096)
+def _parse_latex(string, macro_items):
     tokens = Tokenizer(string)
-    output = ''
-    for result in dispatch(tokens, macros):
-        output += result
-    return substitute_ligatures(output)
+    return substitute_ligatures(decode(tokens, dict(macro_items)))
 
 
 Token = namedtuple('Token', ['type', 'value'])
@@ -25,93 +34,147 @@ CLOSE_SCOPE = 'CLOSE-SCOPE'
 OPEN_SCOPE = 'OPEN-SCOPE'
 START_MACRO = 'START-MACRO'
 CHARACTER = 'CHARACTER'
+END_OF_INPUT = 'END-OF-INPUT'
+
+TOKEN_TYPES = {'\\': START_MACRO,
+               '{': OPEN_SCOPE,
+               '}': CLOSE_SCOPE,
+               ' ': WHITESPACE,
+               '\t': WHITESPACE,
+               '\n': WHITESPACE,
+               '$': TOGGLE_MATH}
+
+
+class TokenTable(dict):
+    """Maps characters to their (shared) token"""
+    def __missing__(self, char):
+        token = self[char] = Token(TOKEN_TYPES.get(char, CHARACTER), char)
+        return token
+
+
+TOKENS = TokenTable()
+
+END = Token(END_OF_INPUT, '')
 
 
 class Tokenizer(object):
+    """Cursor into the string being decoded
+
+    The decoder scans the string directly, but macros parse their arguments
+    through the token interface (`peek` and `next`)."""
+
     def __init__(self, string):
         self.string = string
-        self._tokens = self.tokenize(string)
-        self._next_token = None
-
-    @staticmethod
-    def tokenize(input_string):
-        for char in input_string:
-            if char == '\\':
-                yield Token(START_MACRO, char)
-            elif char == '{':
-                yield Token(OPEN_SCOPE, char)
-            elif char == '}':
-                yield Token(CLOSE_SCOPE, char)
-            elif char in ' \t\n':
-                yield Token(WHITESPACE, char)
-            elif char == '$':
-                yield Token(TOGGLE_MATH, char)
-            else:
-                yield Token(CHARACTER, char)
+        self.position = 0
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        if self._next_token:
-            token = self._next_token
-            self._next_token = None
-        else:
-            token = next(self._tokens)
+        token = self.peek()
+        if token is END:
+            raise StopIteration
+        self.position += 1
         return token
 
     next = __next__
 
     def peek(self):
-        if self._next_token is None:
-            self._next_token = next(self._tokens)
-        return self._next_token
+        try:
+            return TOKENS[self.string[self.position]]
+        except IndexError:
+            return END
+
+
+RE_TEXT = re.compile(r'[^\\{}$]+')
+RE_WHITESPACE = re.compile(r'[ \t\n]*')
+RE_MACRO_NAME = re.compile(r'([^\W\d_]+)[ \t\n]*|(.)', re.DOTALL)
+RE_MATH = re.compile(r'\$((?:\\.?|[^\\$])*)\$?', re.DOTALL)
 
 
 def eat_whitespace(tokens):
-    while tokens.peek().type == WHITESPACE:
-        next(tokens)
+    tokens.position = RE_WHITESPACE.match(tokens.string, tokens.position).end()
 
 
 class ScopeClosing(Exception):
     pass
 
 
-def dispatch(tokens, macros, level=0):
-    while True:
-        try:
-            next_token = tokens.peek()
-        except StopIteration:
-            if level > 0:
-                warn("Unbalanced parenthesis in '{}'".format(tokens.string))
-            break
-        if next_token.type == OPEN_SCOPE:
-            yield handle_scope(tokens, macros, level)
-        elif next_token.type == CLOSE_SCOPE:
-            raise ScopeClosing
-        elif next_token.type == START_MACRO:
-            yield handle_macro(tokens, macros)
-        elif next_token.type == TOGGLE_MATH:
-            yield handle_math(tokens)
+class MissingArgument(Exception):
+    """A macro argument is cut off by a closing brace or the end of the
+    string"""
+
+
+def decode(tokens, macros, group=False):
+    """Decode the string from the current position of `tokens` up to its end,
+    or up to the closing brace of the current group if `group` is true.
+
+    Nested groups are tracked on an explicit stack, so the nesting depth is not
+    limited by the recursion limit."""
+    string = tokens.string
+    end = len(string)
+    position = tokens.position
+    output = []
+    stack = []
+    while position < end:
+        match = RE_TEXT.match(string, position)
+        if match:
+            output.append(match.group())
+            position = match.end()
+            continue
+        char = string[position]
+        if char == '{':
+            stack.append(output)
+            output = []
+            position += 1
+        elif char == '}':
+            position += 1
+            if stack:
+                text = ''.join(output)
+                output = stack.pop()
+                output.append(text)
+            elif group:
+                tokens.position = position
+                return ''.join(output)
+            else:
+                tokens.position = position - 1
+                raise ScopeClosing
+        elif char == '\\':
+            tokens.position = position
+            try:
+                output.append(handle_macro(tokens, macros))
+            except MissingArgument:     # as in '{\\'}' or '\\'': drop it
+                pass
+            position = tokens.position
         else:
-            assert next_token.type in (CHARACTER, WHITESPACE)
-            yield next(tokens).value
-
-
-def handle_scope(tokens, macros, level):
-    assert next(tokens).type == OPEN_SCOPE
-    output = ''
-    try:
-        for result in dispatch(tokens, macros, level + 1):
-            output += result
-    except ScopeClosing:
-        assert next(tokens).type == CLOSE_SCOPE
-    return output
+            assert char == '$'
+            tokens.position = position
+            output.append(handle_math(tokens))
+            position = tokens.position
+    tokens.position = position
+    for _ in range(len(stack) + group):
+        warn("Unbalanced parenthesis in '{}'".format(string))
+    while stack:
+        text = ''.join(output)
+        output = stack.pop()
+        output.append(text)
+    return ''.join(output)
 
 
 def parse_argument(tokens, macros, level=0):
     eat_whitespace(tokens)
-    return next(dispatch(tokens, macros, level))
+    token = tokens.peek()
+    if token.type == OPEN_SCOPE:
+        next(tokens)
+        return decode(tokens, macros, group=True)
+    elif token.type in (CLOSE_SCOPE, END_OF_INPUT):
+        raise MissingArgument
+    elif token.type == START_MACRO:
+        return handle_macro(tokens, macros)
+    elif token.type == TOGGLE_MATH:
+        return handle_math(tokens)
+    else:
+        return next(tokens).value
 
 
 def handle_macro(tokens, macros):
@@ -125,32 +188,23 @@ def handle_macro(tokens, macros):
 
 
 def parse_macro_name(tokens):
-    token = next(tokens)
-    assert token.type in (CHARACTER, TOGGLE_MATH, WHITESPACE)
-    name = token.value
-    if name.isalpha():
-        while tokens.peek().type == CHARACTER and tokens.peek().value.isalpha():
-            name += next(tokens).value
-        eat_whitespace(tokens)
-    return name
+    match = RE_MACRO_NAME.match(tokens.string, tokens.position)
+    if match is None:     # a backslash at the end of the string
+        return ''
+    tokens.position = match.end()
+    return match.group(1) or match.group(2)
 
 
 def handle_math(tokens):
     assert next(tokens).type == TOGGLE_MATH
-    output = ''
-    for token in tokens:
-        if token.type == START_MACRO:
-            output += token.value
-            token = next(tokens)
-        elif token.type == TOGGLE_MATH:
-            break
-        output += token.value
-    return '$' + output + '$'
+    match = RE_MATH.match(tokens.string, tokens.position - 1)
+    tokens.position = match.end()
+    return '$' + match.group(1) + '$'
 
 
 def substitute_ligatures(string):
-    for chars, ligature in SUBSTITUTIONS.items():
-        string = string.replace(chars, unicodedata.lookup(ligature))
+    for regex in RE_LIGATURES:
+        string = regex.sub(lambda match: LIGATURES[match.group()], string)
     return string
 
 
@@ -169,4 +223,23 @@ SUBSTITUTIONS = {"~": 'NO-BREAK SPACE',
 }
 
 
+LIGATURES = {chars: unicodedata.lookup(name)
+             for chars, name in SUBSTITUTIONS.items()}
+
+
+def ligature_regex(*ligatures):
+    # longest match first, so that '---' is not substituted as '--' + '-'
+    return re.compile('|'.join(re.escape(chars) for chars
+                               in sorted(ligatures, key=len, reverse=True)))
+
+
+# substituted in two passes: the quotes take precedence over the inverted
+# exclamation and question marks ('!``' is '!“', not '¡`')
+RE_LIGATURES = [ligature_regex('~', '--', '---', "''", '``'),
+                ligature_regex('!`', '?`', ',,', '<<', '>>')]
+
+RE_SPECIAL = re.compile('|'.join([r'[\\{}$]'] + [regex.pattern for regex
+                                                  in RE_LIGATURES]))
+
+
 from .macro import MACROS
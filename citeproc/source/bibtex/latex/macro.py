@@ -82,6 +82,11 @@ class Symbol(Macro):
     def __init__(self, symbol):
         super(Symbol, self).__init__(0, symbol)
 
+    def expand(self, arguments):
+        # the symbol is not a format string ('{' and '}' are symbols too)
+        assert len(arguments) == self.num_args
+        return self.format_string
+
 
 class SymbolByName(Macro):
     def __init__(self, unicode_symbol_name):
@@ -0,0 +1,95 @@
+
+from . import BibliographySource
+
+
+__all__ = ['ChainedSource']
+
+
+class ChainedSource(BibliographySource):
+    """Bibliography source combining the references of several `sources`
+    without copying them. When a key occurs in more than one source, the
+    reference from the source listed first is used.
+
+    A key to source index is built when the chain is created (only the keys
+    of the sources are read, so lazy sources are not loaded). Call
+    :meth:`reindex` after modifying the underlying sources.
+
+    `collisions` maps each key that occurs in more than one source to the
+    list of these sources, in order of priority.
+    """
+    def __init__(self, *sources):
+        self.sources = list(sources)
+        self.reindex()
+
+    def reindex(self):
+        self.index = {}
+        self.collisions = {}
+        for source in self.sources:
+            for key in source:
+                self._index_key(key, source)
+
+    def _index_key(self, key, source):
+        other = self.index.setdefault(key, source)
+        if other is not source:
+            self.collisions.setdefault(key, [other]).append(source)
+
+    def add(self, entry):
+        """Add `entry` to the first (highest priority) source"""
+        source = self.sources[0]
+        source.add(entry)
+        self.index[entry.key] = source
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getitem__(self, key):
+        return self.index[key][key]
+
+    def get(self, key, default=None):
+        source = self.index.get(key)
+        return default if source is None else source[key]
+
+    def get_many(self, keys):
+        references = {}
+        for source, source_keys in self._group_by_source(keys):
+            references.update(source.get_many(source_keys))
+        return references
+
+    def prefetch(self, keys):
+        for source, source_keys in self._group_by_source(keys):
+            source.prefetch(source_keys)
+
+    def _group_by_source(self, keys):
+        # sources are dicts (unhashable), so group by position
+        groups = [[] for source in self.sources]
+        position = {id(source): i for i, source in enumerate(self.sources)}
+        for key in keys:
+            source = self.index.get(key)
+            if source is not None:
+                groups[position[id(source)]].append(key)
+        return [(source, source_keys)
+                for source, source_keys in zip(self.sources, groups)
+                if source_keys]
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def values(self):
+        return (source[key] for key, source in self.index.items())
+
+    def items(self):
+        return ((key, source[key]) for key, source in self.index.items())
+
+    def __len__(self):
+        return len(self.index)
+
+    def __bool__(self):
+        return bool(self.index)
+
+    def __repr__(self):
+        sources = ', '.join(source.__class__.__name__
+                            for source in self.sources)
+        return '{}({})'.format(self.__class__.__name__, sources)
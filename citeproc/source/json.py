@@ -1,40 +1,74 @@
 
+import json
 import sys
 import unicodedata
 
-from . import BibliographySource, Reference
+from . import BibliographySource, Reference, LazyReference, open_text
 from . import Name, Date, DateRange, LiteralDate
 from ..string import String, MixedString, NoCase
 from .. import NAMES, DATES
 
 
 class CiteProcJSON(BibliographySource):
-    def __init__(self, json_data):
+    def __init__(self, json_data, intern_pool=None, lazy=False,
+                 diagnostics=None):
+        """With `lazy`, the fields of a reference are only converted when they
+        are first accessed (see :class:`LazyReference`)."""
+        self.intern_pool = intern_pool
+        self.lazy = lazy
+        self.diagnostics = diagnostics
         for ref in json_data:
-            ref_data = {}
-            for key, value in ref.items():
-                python_key = key.replace('-', '_')
-                if python_key == 'id':
-                    ref_key = str(value).lower()
-                    continue
-                elif python_key == 'type':
-                    ref_type = value
-                    continue
-                elif python_key == 'key':
-                    # conflicts with the ref_key, so ignore
-                    continue
-                if python_key == 'shortTitle':
-                    python_key = 'title_short'
+            self.add(self.create_reference(ref))
 
-                if python_key in NAMES:
-                    value = self.parse_names(value)
-                elif python_key in DATES:
-                    value = self.parse_date(value)
-                elif key not in ('language', ):
-                    value = self.parse_string(value)
+    @classmethod
+    def from_file(cls, file_or_filename, encoding='utf-8', **kwargs):
+        """Load the references from a file holding either a JSON array of
+        CSL-JSON records or newline-delimited JSON (one record per line).
 
-                ref_data[python_key] = value
-            self.add(Reference(ref_key, ref_type, **ref_data))
+        The records are decoded and converted one at a time, so the whole JSON
+        document is never held in memory. Compressed files are decompressed
+        while reading (see :func:`open_text`)."""
+        try:
+            file = open_text(file_or_filename, encoding)
+        except TypeError:
+            return cls(iter_records(file_or_filename), **kwargs)
+        with file:
+            return cls(iter_records(file), **kwargs)
+
+    def create_reference(self, ref):
+        ref_data = {}
+        for key, value in ref.items():
+            python_key = key.replace('-', '_')
+            if python_key == 'id':
+                ref_key = str(value).lower()
+                continue
+            elif python_key == 'type':
+                ref_type = value
+                continue
+            elif python_key == 'key':
+                # conflicts with the ref_key, so ignore
+                continue
+            if python_key == 'shortTitle':
+                python_key = 'title_short'
+            ref_data[python_key] = value
+        if self.lazy:
+            return LazyReference(ref_key, ref_type, self.convert_field,
+                                 self.diagnostics, **ref_data)
+        for python_key, value in ref_data.items():
+            ref_data[python_key] = self.convert_field(python_key, value)
+        return Reference(ref_key, ref_type, self.diagnostics, **ref_data)
+
+    def convert_field(self, python_key, value):
+        if python_key in NAMES:
+            return self.parse_names(value)
+        elif python_key in DATES:
+            return self.parse_date(value)
+        elif python_key == 'language':
+            return value
+        elif (self.intern_pool is not None
+                and python_key in self.intern_pool.fields):
+            return self.intern('string', value, self.parse_string)
+        return self.parse_string(value)
 
     start_tag = '<span class="nocase">'
     end_tag = '</span>'
@@ -64,10 +98,18 @@ class CiteProcJSON(BibliographySource):
     def parse_names(self, json_data):
         names = []
         for name_data in json_data:
-            name = Name(**name_data)
+            if self.intern_pool is not None:
+                name = self.intern('name', tuple(name_data.items()),
+                                   self._create_name)
+            else:
+                name = Name(**name_data)
             names.append(name)
         return names
 
+    @staticmethod
+    def _create_name(name_items):
+        return Name(**dict(name_items))
+
     def parse_date(self, json_data):
         def parse_single_date(json_date):
             date_data = {}
@@ -96,3 +138,48 @@ class CiteProcJSON(BibliographySource):
             return LiteralDate(json_data['literal'], circa=circa)
         else:
             return None
+
+
+JSON_WHITESPACE = ' \t\n\r'
+
+
+def iter_records(file, chunk_size=1 << 16):
+    """Yield the records of a JSON array, or of newline-delimited JSON, read
+    incrementally from `file`."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    read_size = chunk_size
+    in_array = None
+    while True:
+        while position < len(buffer) and buffer[position] in JSON_WHITESPACE:
+            position += 1
+        if position < len(buffer):
+            char = buffer[position]
+            if in_array is None:
+                in_array = char == '['
+                if in_array:
+                    position += 1
+                    continue
+            if in_array and char == ',':
+                position += 1
+                continue
+            if in_array and char == ']':
+                return
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # incomplete record; read at least as much data as is buffered
+                # so that a large record is not decoded again for every chunk
+                read_size = max(chunk_size, len(buffer) - position)
+            else:
+                yield record
+                continue
+        chunk = file.read(read_size)
+        read_size = chunk_size
+        if not chunk:
+            if position < len(buffer):  # report the decoding error
+                decoder.raw_decode(buffer, position)
+            return
+        buffer = buffer[position:] + chunk
+        position = 0
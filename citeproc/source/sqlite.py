@@ -0,0 +1,189 @@
+
+import pickle
+import sqlite3
+
+from . import BibliographySource, Reference, LRUCache
+
+
+__all__ = ['SQLiteSource']
+
+
+class SQLiteSource(BibliographySource):
+    """Bibliography source that keeps its references in a SQLite database file
+    and only loads them when they are looked up.
+
+    The most recently used references are kept in memory (at most
+    `cache_size`). :meth:`prefetch` grows this limit to the number of keys
+    passed to it, so that the prefetched references (fetched in batches of
+    `BATCH_SIZE` keys) are not evicted before they are looked up. Each process
+    should create its own instance; pickling a SQLiteSource (e.g. to pass it
+    to a worker process) reopens the database.
+    """
+    # maximum number of keys per query (SQLite limits the number of
+    # parameters)
+    BATCH_SIZE = 500
+
+    def __init__(self, filename, cache_size=1024):
+        self.filename = filename
+        self.cache_size = cache_size
+        self.cache = LRUCache(cache_size)
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS reference '
+                                '(key TEXT PRIMARY KEY, data BLOB NOT NULL)')
+
+    @classmethod
+    def from_source(cls, filename, source, **kwargs):
+        """Create (or extend) the database `filename` with the references of
+        `source`, e.g. a :class:`BibTeX` or :class:`CiteProcJSON` source"""
+        sqlite_source = cls(filename, **kwargs)
+        sqlite_source.add_many(source.values())
+        return sqlite_source
+
+    def __reduce__(self):
+        return self.__class__, (self.filename, self.cache_size)
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, entry):
+        self.add_many([entry])
+
+    def add_many(self, entries):
+        self._store((entry.key, entry) for entry in entries)
+
+    def __setitem__(self, key, reference):
+        self._store([(key, reference)])
+
+    def _store(self, items):
+        rows = ((key, self._dump(reference)) for key, reference in items)
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO reference '
+                                        'VALUES (?, ?)', rows)
+        self.cache.clear()
+
+    def __delitem__(self, key):
+        with self.connection:
+            cursor = self.connection.execute('DELETE FROM reference '
+                                             'WHERE key = ?', (key, ))
+        self.cache.pop(key)
+        if cursor.rowcount == 0:
+            raise KeyError(key)
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute('DELETE FROM reference')
+        self.cache.clear()
+
+    # the references are not stored in the dict itself, so the remaining dict
+    # mutators are built on the methods above
+
+    _marker = object()
+
+    def pop(self, key, default=_marker):
+        try:
+            reference = self[key]
+        except KeyError:
+            if default is self._marker:
+                raise
+            return default
+        del self[key]
+        return reference
+
+    def popitem(self):
+        for key in self:
+            return key, self.pop(key)
+        raise KeyError('popitem(): source is empty')
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def update(self, *args, **kwargs):
+        self._store(dict(*args, **kwargs).items())
+
+    def __contains__(self, key):
+        if key in self.cache:
+            return True
+        cursor = self.connection.execute('SELECT 1 FROM reference '
+                                         'WHERE key = ?', (key, ))
+        return cursor.fetchone() is not None
+
+    def __getitem__(self, key):
+        reference = self.cache.get(key)
+        if reference is None:
+            cursor = self.connection.execute('SELECT data FROM reference '
+                                             'WHERE key = ?', (key, ))
+            row = cursor.fetchone()
+            if row is None:
+                raise KeyError(key)
+            reference = self._load(row[0])
+            self.cache.put(key, reference)
+        return reference
+
+    def get_many(self, keys):
+        references = {}
+        missing = []
+        for key in keys:
+            reference = self.cache.get(key)
+            if reference is not None:
+                references[key] = reference
+            else:
+                missing.append(key)
+        for start in range(0, len(missing), self.BATCH_SIZE):
+            batch = missing[start:start + self.BATCH_SIZE]
+            query = ('SELECT key, data FROM reference WHERE key IN ({})'
+                     .format(', '.join('?' * len(batch))))
+            for key, data in self.connection.execute(query, batch):
+                references[key] = reference = self._load(data)
+                self.cache.put(key, reference)
+        return references
+
+    def prefetch(self, keys):
+        keys = set(keys)
+        self.cache.maxsize = max(self.cache.maxsize, len(keys))
+        self.get_many(keys)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        cursor = self.connection.execute('SELECT key FROM reference')
+        return (key for key, in cursor)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return (self[key] for key in self.keys())
+
+    def items(self):
+        return ((key, self[key]) for key in self.keys())
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM reference') \
+                   .fetchone()[0]
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.filename)
+
+    @staticmethod
+    def _dump(reference):
+        # store the converted fields only; this also materializes lazy
+        # references and drops the link to their source
+        return pickle.dumps(dict(reference.items()), pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _load(data):
+        # the fields were validated when the reference was first created
+        reference = Reference.__new__(Reference)
+        dict.update(reference, pickle.loads(data))
+        return reference
@@ -0,0 +1,448 @@
+
+import mmap
+import pickle
+import struct
+import sys
+
+from bisect import bisect_left
+from io import BytesIO
+from multiprocessing.shared_memory import SharedMemory
+
+from . import BibliographySource, LazyReference, LRUCache
+from . import Name, Date, DateRange, LiteralDate
+from ..string import String, MixedString, NoCase
+
+
+__all__ = ['StoreSource', 'SharedMemorySource', 'write', 'dumps']
+
+
+# File layout (all integers little-endian)
+#
+#   header     magic, version, string count, reference count, offset of the
+#              string table and offset of the key index
+#   records    one record per reference (see below)
+#   strings    (string count + 1) absolute offsets into the string data,
+#              followed by the UTF-8 encoded string data
+#   index      (key string ID, record offset) pairs, sorted by key
+#
+# Strings (keys, types, field names and string values) are stored once in the
+# string table and referred to by ID. A record consists of the key and type
+# string IDs, the number of fields and (field name string ID, value offset
+# relative to the record) pairs, followed by the tagged field values.
+
+MAGIC = b'CSLSTORE'
+VERSION = 1
+
+HEADER = struct.Struct('<8sIIQQQ')
+OFFSET = struct.Struct('<Q')
+INDEX_ENTRY = struct.Struct('<IQ')
+RECORD_HEAD = struct.Struct('<IIH')
+FIELD = struct.Struct('<II')
+UINT8 = struct.Struct('<B')
+UINT32 = struct.Struct('<I')
+INT64 = struct.Struct('<q')
+DATE = struct.Struct('<iBBB')
+
+# value tags
+NONE, STR, STRING, NOCASE, MIXED_STRING, INT, LIST = range(7)
+NAME, DATE_, DATE_RANGE, LITERAL_DATE = range(7, 11)
+PICKLE = 255
+
+STRING_TAGS = {str: STR, String: STRING, NoCase: NOCASE}
+STRING_TYPES = {tag: cls for cls, tag in STRING_TAGS.items()}
+
+NAME_PARTS = ('given', 'family', 'dropping-particle', 'non-dropping-particle',
+              'suffix', 'literal')
+
+# date flags
+MONTH, DAY, CIRCA, SEASON, END = 1, 2, 4, 8, 16
+
+
+class StoreSource(BibliographySource):
+    """Read-only bibliography source backed by a file in the store format,
+    created by :func:`write` or :meth:`from_source`.
+
+    The file is memory-mapped, so processes opening the same file share its
+    pages. A reference is only read when it is looked up and its fields are
+    only decoded when accessed; at most `cache_size` references are kept.
+    """
+    def __init__(self, filename, cache_size=1024):
+        self.filename = filename
+        with open(filename, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._attach(buffer, cache_size)
+
+    @classmethod
+    def from_source(cls, filename, source, **kwargs):
+        """Write the references of `source` to the file `filename` and open
+        it"""
+        write(source, filename)
+        return cls(filename, **kwargs)
+
+    def _attach(self, buffer, cache_size):
+        self.buffer = buffer
+        self.cache_size = cache_size
+        self.cache = LRUCache(cache_size)
+        (magic, version, self._string_count, self._reference_count,
+         self._strings_offset, self._index_offset) \
+            = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a citeproc-py reference store (version {})'
+                             .format(VERSION))
+        self._keys = _Keys(self)
+
+    def __reduce__(self):
+        return self.__class__, (self.filename, self.cache_size)
+
+    def close(self):
+        self.cache.clear()
+        self.buffer.close()
+
+    def _string(self, index):
+        start, end = struct.unpack_from('<QQ', self.buffer,
+                                        self._strings_offset + 8 * index)
+        return str(self.buffer[start:end], 'utf-8')
+
+    def _index_entry(self, position):
+        return INDEX_ENTRY.unpack_from(self.buffer, self._index_offset
+                                       + INDEX_ENTRY.size * position)
+
+    def _find(self, key):
+        position = bisect_left(self._keys, key)
+        if position < self._reference_count and self._keys[position] == key:
+            return self._index_entry(position)[1]
+
+    def __contains__(self, key):
+        return key in self.cache or self._find(key) is not None
+
+    def __getitem__(self, key):
+        reference = self.cache.get(key)
+        if reference is None:
+            offset = self._find(key)
+            if offset is None:
+                raise KeyError(key)
+            reference = self._read_reference(offset)
+            self.cache.put(key, reference)
+        return reference
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return (self[key] for key in self)
+
+    def items(self):
+        return ((key, self[key]) for key in self)
+
+    def __len__(self):
+        return self._reference_count
+
+    def __bool__(self):
+        return self._reference_count > 0
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.filename)
+
+    # the store is read-only; the inherited dict methods would modify the
+    # (unused) dict storage instead
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('{} is read-only'.format(self.__class__.__name__))
+
+    add = __setitem__ = __delitem__ = _read_only
+    update = pop = popitem = setdefault = clear = _read_only
+
+    def _read_reference(self, offset):
+        buffer = self.buffer
+        key_id, type_id, field_count = RECORD_HEAD.unpack_from(buffer, offset)
+        fields = {}
+        position = offset + RECORD_HEAD.size
+        for i in range(field_count):
+            name_id, value_offset = FIELD.unpack_from(buffer, position)
+            fields[self._string(name_id)] = offset + value_offset
+            position += FIELD.size
+        return LazyReference(self._string(key_id), self._string(type_id),
+                             self._read_field, **fields)
+
+    def _read_field(self, name, offset):
+        return self._read_value(offset)[0]
+
+    def _read_value(self, offset):
+        buffer = self.buffer
+        tag, = UINT8.unpack_from(buffer, offset)
+        offset += 1
+        if tag in STRING_TYPES:
+            index, = UINT32.unpack_from(buffer, offset)
+            return STRING_TYPES[tag](self._string(index)), offset + 4
+        elif tag == NONE:
+            return None, offset
+        elif tag == INT:
+            return INT64.unpack_from(buffer, offset)[0], offset + 8
+        elif tag in (MIXED_STRING, LIST):
+            count, = UINT32.unpack_from(buffer, offset)
+            offset += 4
+            items = []
+            for i in range(count):
+                item, offset = self._read_value(offset)
+                items.append(item)
+            return (MixedString(items) if tag == MIXED_STRING
+                    else items), offset
+        elif tag == NAME:
+            mask, = UINT8.unpack_from(buffer, offset)
+            offset += 1
+            parts = {}
+            for bit, part in enumerate(NAME_PARTS):
+                if mask & (1 << bit):
+                    parts[part], offset = self._read_value(offset)
+            return _new(Name, parts), offset
+        elif tag == DATE_:
+            year, month, day, flags = DATE.unpack_from(buffer, offset)
+            offset += DATE.size
+            date = {'year': year, 'circa': bool(flags & CIRCA)}
+            if flags & MONTH:
+                date['month'] = month
+            if flags & DAY:
+                date['day'] = day
+            if flags & SEASON:
+                date['season'], offset = self._read_value(offset)
+            return _new(Date, date), offset
+        elif tag == DATE_RANGE:
+            flags, = UINT8.unpack_from(buffer, offset)
+            date_range = {'circa': bool(flags & CIRCA)}
+            date_range['begin'], offset = self._read_value(offset + 1)
+            if flags & END:
+                date_range['end'], offset = self._read_value(offset)
+            return _new(DateRange, date_range), offset
+        elif tag == LITERAL_DATE:
+            flags, = UINT8.unpack_from(buffer, offset)
+            text, offset = self._read_value(offset + 1)
+            return _new(LiteralDate, {'text': text,
+                                      'circa': bool(flags & CIRCA)}), offset
+        elif tag == PICKLE:
+            length, = UINT32.unpack_from(buffer, offset)
+            offset += 4
+            return pickle.loads(buffer[offset:offset + length]), offset + length
+        raise ValueError('Unknown value tag {} in reference store'.format(tag))
+
+
+class SharedMemorySource(StoreSource):
+    """Read-only bibliography source in a block of shared memory, in the
+    store format. It allows the processes of a `multiprocessing` pool to share
+    a single copy of the references.
+
+    Create it using :meth:`publish` in the parent process. Pickling the
+    source (e.g. passing it as an argument to a pool worker) attaches to the
+    same block, as does creating a SharedMemorySource with the block's
+    `name`. The publishing process should call :meth:`unlink` when the
+    workers are done.
+
+    Before Python 3.13, the resource tracker of a process that attaches to
+    the block removes it on exit, unless that process was started by the
+    publishing process (through `multiprocessing`).
+    """
+    def __init__(self, name, cache_size=1024):
+        if sys.version_info >= (3, 13):
+            memory = SharedMemory(name, track=False)
+        else:
+            memory = SharedMemory(name)
+        self._open(memory, cache_size, owner=False)
+
+    @classmethod
+    def publish(cls, source, cache_size=1024):
+        """Copy the references of `source` into a new shared memory block"""
+        data = dumps(source)
+        memory = SharedMemory(create=True, size=len(data))
+        memory.buf[:len(data)] = data
+        shared = cls.__new__(cls)
+        shared._open(memory, cache_size, owner=True)
+        return shared
+
+    def _open(self, memory, cache_size, owner):
+        self.memory = memory
+        self.name = memory.name
+        self.owner = owner
+        self._attach(memory.buf, cache_size)
+
+    def __reduce__(self):
+        return self.__class__, (self.name, self.cache_size)
+
+    def close(self):
+        self.cache.clear()
+        self.buffer = self._keys = None
+        self.memory.close()
+
+    def unlink(self):
+        """Close this source and free the shared memory block"""
+        self.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.name)
+
+
+class _Keys(object):
+    """Sorted sequence of the keys in a store (for bisect)"""
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return self.store._reference_count
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.store._reference_count:
+            raise IndexError(position)
+        return self.store._string(self.store._index_entry(position)[0])
+
+
+def _new(cls, items):
+    # the values were validated when the original objects were created
+    obj = cls.__new__(cls)
+    dict.update(obj, items)
+    return obj
+
+
+def write(source, file_or_filename):
+    """Write the references of `source` in the store format to a binary file
+    (object) that supports seeking"""
+    try:
+        file = open(file_or_filename, 'wb')
+    except TypeError:
+        _Writer(file_or_filename).write(source)
+    else:
+        with file:
+            _Writer(file).write(source)
+
+
+def dumps(source):
+    """Return the references of `source` encoded in the store format"""
+    file = BytesIO()
+    _Writer(file).write(source)
+    return file.getvalue()
+
+
+class _Writer(object):
+    def __init__(self, file):
+        self.file = file
+        self.strings = {}
+
+    def string_id(self, string):
+        string = str(string)
+        try:
+            return self.strings[string]
+        except KeyError:
+            index = self.strings[string] = len(self.strings)
+            return index
+
+    def write(self, source):
+        file = self.file
+        start = file.tell()
+        file.write(b'\0' * HEADER.size)
+        offset = HEADER.size
+        index = []
+        for reference in source.values():
+            record = self.encode_reference(reference)
+            index.append((reference.key, offset))
+            file.write(record)
+            offset += len(record)
+
+        strings_offset = offset
+        string_data = [string.encode('utf-8') for string in self.strings]
+        position = strings_offset + OFFSET.size * (len(string_data) + 1)
+        offsets = bytearray()
+        for data in string_data + [b'']:
+            offsets += OFFSET.pack(position)
+            position += len(data)
+        file.write(offsets)
+        file.write(b''.join(string_data))
+
+        index_offset = position
+        index.sort()
+        file.write(b''.join(INDEX_ENTRY.pack(self.strings[key], offset)
+                            for key, offset in index))
+        end = file.tell()
+        file.seek(start)
+        file.write(HEADER.pack(MAGIC, VERSION, len(self.strings), len(index),
+                               strings_offset, index_offset))
+        file.seek(end)
+
+    def encode_reference(self, reference):
+        self.string_id(reference.key)
+        fields = [(name, value) for name, value in reference.items()
+                  if name not in ('key', 'type')]
+        values = bytearray()
+        value_offset = RECORD_HEAD.size + FIELD.size * len(fields)
+        head = bytearray(RECORD_HEAD.pack(self.string_id(reference.key),
+                                          self.string_id(reference.type),
+                                          len(fields)))
+        for name, value in fields:
+            head += FIELD.pack(self.string_id(name),
+                               value_offset + len(values))
+            self.encode_value(value, values)
+        return bytes(head + values)
+
+    def encode_value(self, value, out):
+        cls = type(value)
+        if cls in STRING_TAGS:
+            out += UINT8.pack(STRING_TAGS[cls])
+            out += UINT32.pack(self.string_id(value))
+        elif value is None:
+            out += UINT8.pack(NONE)
+        elif cls is int and -2 ** 63 <= value < 2 ** 63:
+            out += UINT8.pack(INT) + INT64.pack(value)
+        elif cls in (MixedString, list):
+            out += UINT8.pack(MIXED_STRING if cls is MixedString else LIST)
+            out += UINT32.pack(len(value))
+            for item in list.__iter__(value):
+                self.encode_value(item, out)
+        elif cls is Name and set(value) <= set(NAME_PARTS):
+            out += UINT8.pack(NAME)
+            out += UINT8.pack(sum(1 << bit for bit, part
+                                  in enumerate(NAME_PARTS) if part in value))
+            for part in NAME_PARTS:
+                if part in value:
+                    self.encode_value(value[part], out)
+        elif cls is Date and _is_compact_date(value):
+            flags = ((MONTH if 'month' in value else 0)
+                     | (DAY if 'day' in value else 0)
+                     | (SEASON if 'season' in value else 0)
+                     | (CIRCA if value.get('circa') else 0))
+            out += UINT8.pack(DATE_)
+            out += DATE.pack(value['year'], value.get('month', 0),
+                             value.get('day', 0), flags)
+            if 'season' in value:
+                self.encode_value(value['season'], out)
+        elif (cls is DateRange and set(value) <= {'begin', 'end', 'circa'}
+                and value.get('circa') in (0, 1)):
+            flags = ((END if 'end' in value else 0)
+                     | (CIRCA if value.get('circa') else 0))
+            out += UINT8.pack(DATE_RANGE) + UINT8.pack(flags)
+            self.encode_value(value['begin'], out)
+            if 'end' in value:
+                self.encode_value(value['end'], out)
+        elif (cls is LiteralDate and set(value) <= {'text', 'circa'}
+                and value.get('circa') in (0, 1)):
+            out += UINT8.pack(LITERAL_DATE)
+            out += UINT8.pack(CIRCA if value.get('circa') else 0)
+            self.encode_value(value['text'], out)
+        else:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            out += UINT8.pack(PICKLE) + UINT32.pack(len(data)) + data
+
+
+def _is_compact_date(date):
+    year, month, day = (date.get(part, 0) for part in ('year', 'month', 'day'))
+    return (set(date) <= {'year', 'month', 'day', 'season', 'circa'}
+            and type(year) is int and -2 ** 31 <= year < 2 ** 31
+            and type(month) is int and 0 <= month < 256
+            and type(day) is int and 0 <= day < 256
+            and date.get('circa') in (0, 1))
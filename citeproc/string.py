@@ -17,30 +17,61 @@ def normalize_seam(left, other):
     either side (e.g. an ellipsis inside a title) is never touched. Markup
     segments start with '<', so they are left alone. Returns `other`, possibly
     with its first character removed."""
-    left = str(left)
-    other_str = str(other)
-    if not left or not other_str:
+    last, left_styles = _edge(left, -1)
+    first, other_styles = _edge(other, 0)
+    if not last or not first:
         return other
-    last, first = left[-1], other_str[0]
-    # collapse a double space
-    if last == ' ' and first == ' ':
-        return _strip_first_char(other)
-    # drop a duplicated punctuation mark ('..' -> '.', ',,' -> ',', ...)
-    if last == first and first in SEAM_PUNCTUATION:
-        return _strip_first_char(other)
+    # collapse a double space or drop a duplicated punctuation mark
+    # ('..' -> '.', ',,' -> ',', ...)
+    if last == first and (first == ' ' or first in SEAM_PUNCTUATION):
+        return _strip_first_char(other, left_styles + other_styles)
     return other
 
 
-def _strip_first_char(other):
+def _edge(text, index):
+    """Return the first (`index` 0) or last (-1) character of `text` and the
+    styles of the :mod:`citeproc.formatter.tree` spans enclosing it, without
+    joining the segments of a MixedString"""
+    if isinstance(text, MixedString):
+        segments = list.__iter__(text) if index == 0 else reversed(text)
+        for segment in segments:
+            char, styles = _edge(segment, index)
+            if char:
+                return char, styles
+        return '', ()
+    children = getattr(text, 'children', None)     # formatter.tree.Span
+    if children is not None:
+        char, styles = _edge(children, index)
+        return char, styles + (text.style, )
+    if isinstance(text, Elided):
+        # whether or not it is dropped, the text before ends in this character
+        return (text.char if index == -1 else ''), ()
+    text = str(text)
+    return (text[index] if text else ''), ()
+
+
+def _strip_first_char(other, styles=()):
     """Return a copy of `other` with its first character removed, preserving
-    the (Mixed)String segment structure."""
+    the (Mixed)String segment structure. If the character borders on spans
+    with the given `styles`, it is kept as an :class:`Elided` segment."""
     if isinstance(other, MixedString):
         segments = list(other)
-        head = segments[0]
-        stripped = type(head)(str(head)[1:])
-        segments[0:1] = [stripped] if stripped != '' else []
+        index = 0
+        while not _edge(segments[index], 0)[0]:
+            index += 1
+        stripped = _strip_first_char(segments[index], styles)
+        segments[index:index + 1] = [stripped] if stripped != '' else []
         return MixedString(segments)
-    return type(other)(str(other)[1:])
+    elif hasattr(other, 'strip_first_char'):    # formatter.tree.Span
+        return other.strip_first_char(styles)
+    text = str(other)
+    stripped = type(other)(text[1:])
+    if styles:
+        segments = [Elided(text[0], styles)]
+        if stripped != '':
+            segments.append(stripped)
+        return MixedString(segments)
+    return stripped
 
 
 def discard_empty_other(method):
@@ -56,6 +87,10 @@ def discard_empty_other(method):
 
 
 class String(str):
+    def __reduce__(self):
+        # more compact and faster than the default for str subclasses
+        return self.__class__, (str(self), )
+
     @discard_empty_other
     def __radd__(self, other):
         return MixedString([other]).__add__(self)
@@ -157,6 +192,27 @@ class MixedString(list):
                 yield word
 
 
+class Elided(String):
+    """Character dropped at a concatenation seam bordering on spans of
+    :mod:`citeproc.formatter.tree`. The eager formatters only drop it if the
+    spans' markup does not separate it from its duplicate, so the decision is
+    left to :func:`citeproc.formatter.tree.serialize`."""
+    def __new__(cls, char, styles):
+        elided = super(Elided, cls).__new__(cls, '')
+        elided.char = char
+        elided.styles = styles
+        return elided
+
+    def __reduce__(self):
+        return self.__class__, (self.char, self.styles)
+
+    def _unchanged(self, *args, **kwargs):
+        return self
+
+    replace = translate = rstrip = lower = upper = _unchanged
+    capitalize_first = _unchanged
+
+
 class NoCase(String):
     def __repr__(self):
         return '{}({})'.format(self.__class__.__name__, str(self))
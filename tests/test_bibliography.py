@@ -1,13 +1,24 @@
 # coding: utf-8
+import io
+import os
+import pickle
+import shutil
+import tempfile
+
+import citeproc
+
 from citeproc import (
     Citation,
     CitationItem,
     CitationStylesBibliography,
     CitationStylesStyle,
+    RenderCache,
+    SQLiteRenderCache,
     formatter,
     source,
 )
-from unittest import TestCase
+from unittest import TestCase, mock
+from citeproc.cache import style_fingerprint
 from citeproc.source.bibtex.bibparse import BibTeXParser
 
 template = {
@@ -89,3 +100,208 @@ class TestBibliographyGeneration(TestCase):
         assert ordinals[1] == "2nd", f"Expected '2nd', got '{ordinals[1]}'"
         assert ordinals[2] == "3rd", f"Expected '3rd', got '{ordinals[2]}'"
         assert ordinals[3] == "4th", f"Expected '4th', got '{ordinals[3]}'"
+
+
+def _entries(count):
+    return [dict(template, id=str(n), title="Book {}".format(n),
+                 author=[{"family": "Author{:03}".format(n)}])
+            for n in range(count)]
+
+
+def _bibliography(count, output_formatter=formatter.plain):
+    bib_style = CitationStylesStyle("harvard-cite-them-right", validate=False)
+    bibliography = CitationStylesBibliography(
+        bib_style, source.json.CiteProcJSON(_entries(count)), output_formatter)
+    bibliography.register(Citation([CitationItem(str(n))
+                                    for n in reversed(range(count))]))
+    return bibliography
+
+
+class TestStreamingBibliography(TestCase):
+    def test_iter(self):
+        bibliography = _bibliography(5)
+        bibliography.sort()
+        iterator = bibliography.iter_bibliography()
+        self.assertTrue(str(next(iterator)).startswith("Author000"))
+        self.assertEqual([str(entry) for entry in bibliography.bibliography()],
+                         [str(entry) for entry in
+                          bibliography.iter_bibliography()])
+
+    def test_write(self):
+        bibliography = _bibliography(3, formatter.html)
+        expected = [str(entry) for entry in bibliography.bibliography()]
+        text = io.StringIO()
+        self.assertEqual(bibliography.write_bibliography(text), 3)
+        self.assertEqual(text.getvalue(), "".join(entry + "\n"
+                                                  for entry in expected))
+        binary = io.BytesIO()
+        bibliography.write_bibliography(
+            binary, entry='<div class="csl-entry">{}</div>',
+            header='<div class="csl-bib-body">', footer="</div>")
+        self.assertFalse(binary.closed)
+        self.assertEqual(binary.getvalue().decode("utf-8"),
+                         '<div class="csl-bib-body">'
+                         + "".join('<div class="csl-entry">{}</div>'.format(entry)
+                                   for entry in expected)
+                         + "</div>")
+
+    def test_write_error(self):
+        bibliography = _bibliography(3, formatter.html)
+        binary = io.BytesIO()
+        with self.assertRaises(KeyError):
+            bibliography.write_bibliography(binary, entry="{missing}",
+                                            header="<div>")
+        self.assertFalse(binary.closed)
+        self.assertEqual(binary.getvalue(), b"<div>")
+
+
+class TestPartialBibliography(TestCase):
+    def test_slice(self):
+        bibliography = _bibliography(6)
+        bibliography.sort()
+        entries = [str(entry) for entry in bibliography.bibliography()]
+        self.assertEqual([str(entry) for entry in bibliography.bibliography(2, 4)],
+                         entries[2:4])
+        self.assertEqual([str(entry) for entry in
+                          bibliography.iter_bibliography(stop=2)], entries[:2])
+
+    def test_top(self):
+        sorted_bibliography = _bibliography(6)
+        sorted_bibliography.sort()
+        bibliography = _bibliography(6)
+        bibliography.sort(top=2)
+        self.assertEqual(bibliography.keys[:2], sorted_bibliography.keys[:2])
+        self.assertEqual(sorted(bibliography.keys),
+                         sorted(sorted_bibliography.keys))
+        self.assertEqual([str(entry) for entry in bibliography.bibliography(0, 2)],
+                         [str(entry) for entry in
+                          sorted_bibliography.bibliography(0, 2)])
+
+
+class TestBulkRendering(TestCase):
+    def test_iter_references(self):
+        expected = _bibliography(3)
+        bibliography = CitationStylesBibliography(
+            expected.style, source.json.CiteProcJSON(_entries(3)),
+            formatter.plain)
+        bibliography.register_all()
+        self.assertEqual(bibliography.keys, ["0", "1", "2"])
+        records = list(bibliography.iter_references())
+        self.assertEqual([record["id"] for record in records], ["0", "1", "2"])
+        self.assertEqual([record["bibliography"] for record in records],
+                         [str(entry) for entry in expected.bibliography()][::-1])
+        self.assertEqual(list(bibliography.iter_references(entries=False,
+                                                           stop=1)),
+                         [{"id": "0", "citation": "(Author000, 1968)"}])
+
+
+class TestRenderCache(TestCase):
+    def render(self, cache, style="harvard-cite-them-right"):
+        bib_style = CitationStylesStyle(style, validate=False)
+        bibliography = CitationStylesBibliography(
+            bib_style, source.json.CiteProcJSON(_entries(3)), formatter.plain,
+            cache=cache)
+        citations = [Citation([CitationItem(str(n))]) for n in range(3)]
+        bibliography.register_many(citations)
+        bibliography.sort()
+        return ([str(bibliography.cite(citation, None))
+                 for citation in citations]
+                + [str(entry) for entry in bibliography.bibliography()])
+
+    def test_cache(self):
+        expected = self.render(None)
+        cache = RenderCache()
+        self.assertEqual(self.render(cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (0, 6))
+        self.assertEqual(self.render(cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (6, 6))
+        self.assertEqual(len(cache), 6)
+        # a different formatter does not share the cached output
+        bibliography = CitationStylesBibliography(
+            CitationStylesStyle("harvard-cite-them-right", validate=False),
+            source.json.CiteProcJSON(_entries(1)), formatter.html, cache=cache)
+        bibliography.register(Citation([CitationItem("0")]))
+        self.assertIn("<i>Book 0</i>", str(bibliography.bibliography()[0]))
+
+    def test_document_dependent(self):
+        cache = RenderCache(maxsize=2)
+        expected = self.render(None, "ieee")
+        self.assertEqual(self.render(cache, "ieee"), expected)
+        self.assertEqual(self.render(cache, "ieee"), expected)
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (0, 0, 0))
+
+
+class TestSQLiteRenderCache(TestCase):
+    render = TestRenderCache.render
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "cache.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_persistent(self):
+        expected = self.render(None)
+        cache = SQLiteRenderCache(self.filename)
+        self.assertEqual(self.render(cache), expected)
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (0, 6, 6))
+        cache.close()
+        # a new process starts with a warm cache
+        cache = pickle.loads(pickle.dumps(SQLiteRenderCache(self.filename)))
+        self.assertEqual(self.render(cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (6, 0))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        cache.close()
+
+    # the layout's formatting wraps the whole entry
+    ITALIC_STYLE = b"""<style xmlns="http://purl.org/net/xbiblio/csl"
+        class="in-text" version="1.0">
+      <info><title>Italic</title><id>italic</id>
+        <updated>2024-01-01T00:00:00+00:00</updated></info>
+      <citation><layout><text variable="title"/></layout></citation>
+      <bibliography>
+        <layout font-style="italic"><text variable="title"/></layout>
+      </bibliography>
+    </style>"""
+
+    def test_formatted(self):
+        def render(cache, output_formatter):
+            style = CitationStylesStyle(io.BytesIO(self.ITALIC_STYLE),
+                                        validate=False)
+            bibliography = CitationStylesBibliography(
+                style, source.json.CiteProcJSON(_entries(1)),
+                output_formatter, cache=cache)
+            bibliography.register(Citation([CitationItem("0")]))
+            return str(bibliography.bibliography()[0])
+
+        for output_formatter, expected in ((formatter.html, "<i>Book 0</i>"),
+                                           (formatter.rst,
+                                            ":emphasis:`Book 0`")):
+            self.assertEqual(render(None, output_formatter), expected)
+            cache = SQLiteRenderCache(self.filename)
+            self.assertEqual(render(cache, output_formatter), expected)
+            cache.close()
+            # read back from the database by another instance
+            cache = SQLiteRenderCache(self.filename)
+            self.assertEqual(render(cache, output_formatter), expected)
+            self.assertEqual((cache.hits, cache.misses), (1, 0))
+            cache.close()
+
+    def test_version(self):
+        # output cached by another citeproc-py version is not used
+        style = CitationStylesStyle("harvard-cite-them-right", validate=False)
+        fingerprint = style_fingerprint(style)
+        with mock.patch.object(citeproc, "__version__", "0.0"):
+            self.assertNotEqual(style_fingerprint(style), fingerprint)
+
+    def test_evict(self):
+        cache = SQLiteRenderCache(self.filename, max_bytes=100)
+        cache.put_many([(str(n), "x" * 30) for n in range(5)])
+        cache.evict()
+        self.assertEqual(len(cache), 2)
+        cache.entries.clear()
+        self.assertIsNone(cache.get("0"))
+        self.assertEqual(cache.get("4"), "x" * 30)
+        cache.close()
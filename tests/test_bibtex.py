@@ -1,9 +1,20 @@
 # coding: utf-8
 
+import os
+import pickle
+import shutil
+import tempfile
+import warnings
+
 from unittest import TestCase
 
+from citeproc.source import Diagnostics
 from citeproc.source.bibtex import BibTeX
-from citeproc.source.bibtex.bibtex import split_names, split_name, parse_name
+from citeproc.source.bibtex.bibtex import (split_names, split_name, parse_name,
+                                           parse_names)
+
+
+TEST_BIB = os.path.join(os.path.dirname(__file__), 'test.bib')
 
 
 class TestBibTeX(TestCase):
@@ -29,6 +40,15 @@ class TestBibTeX(TestCase):
             print('{:24}  {}'.format(name, parse_name(name)))
             self.assertEqual(parse_name(name), reference)
 
+    def test_parse_names(self):
+        names = [name for name, _ in DECORET_NAMES + PYBTEX_NAMES + EXTRA_NAMES]
+        for names_string, _ in SPLIT_NAMES:
+            self.assertEqual(parse_names(names_string),
+                             [parse_name(name)
+                              for name in split_names(names_string)])
+        self.assertEqual(parse_names(' and '.join(names * 100)),
+                         [parse_name(name) for name in names * 100])
+
     def test_date_months(self):
         for january in ['jan', 'JAN', '01']:
             self.assertEqual(BibTeX._parse_month(january),
@@ -54,6 +74,105 @@ class TestBibTeX(TestCase):
         # Arabic letters
         test('ا-ي', 'ا-ي')
 
+    def test_cache(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        cache_dir = os.path.join(temp_dir, 'cache')
+        bib_path = os.path.join(temp_dir, 'test.bib')
+        shutil.copy(TEST_BIB, bib_path)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            reference = BibTeX(bib_path, encoding='utf-8')
+            converted = BibTeX(bib_path, encoding='utf-8', cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            cached = BibTeX(bib_path, encoding='utf-8', cache_dir=cache_dir)
+            self.assertEqual(converted, reference)
+            self.assertEqual(cached, reference)
+            self.assertEqual(repr(cached['blakley1979'].title),
+                             repr(reference['blakley1979'].title))
+            # a modified database file triggers a rebuild
+            with open(bib_path, 'a', encoding='utf-8') as bib_file:
+                bib_file.write('@book{new, title={New}, year={2000}}\n')
+            rebuilt = BibTeX(bib_path, encoding='utf-8', cache_dir=cache_dir)
+        self.assertIn('new', rebuilt)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+    def test_bad_cache(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        bib_path = os.path.join(temp_dir, 'test.bib')
+        shutil.copy(TEST_BIB, bib_path)
+        cache_path = BibTeX._cache_path(bib_path, 'utf-8', temp_dir)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            reference = BibTeX(bib_path, encoding='utf-8')
+            for data in (pickle.dumps((1, 2, [3]))[:-3],    # truncated
+                         pickle.dumps(([], {}, 5)),         # foreign
+                         b'garbage'):
+                with open(cache_path, 'wb') as cache_file:
+                    cache_file.write(data)
+                cached = BibTeX(bib_path, encoding='utf-8', cache_dir=temp_dir)
+                self.assertEqual(cached, reference)
+            # the cache is not used with an intern pool or diagnostics
+            os.remove(cache_path)
+            BibTeX(bib_path, encoding='utf-8', cache_dir=temp_dir,
+                   diagnostics=Diagnostics())
+            self.assertFalse(os.path.exists(cache_path))
+
+    def test_refresh(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        bib_path = os.path.join(temp_dir, 'refresh.bib')
+
+        def write(text):
+            with open(bib_path, 'w', encoding='utf-8') as bib_file:
+                bib_file.write(text)
+
+        write(REFRESH_BIB)
+        bib = BibTeX(bib_path, encoding='utf-8', watch=True)
+        self.assertEqual(set(bib), {'one', 'two', 'three'})
+        self.assertEqual(bib.refresh(), set())
+        unchanged = bib['three']
+        write(REFRESH_BIB.replace('Second', 'Modified')
+                         .replace('@book{one, title={First}, year={2001}}\n', '')
+                         + '@book{four, title={Fourth}, year={2004}}\n')
+        self.assertEqual(bib.refresh(), {'one', 'two', 'four'})
+        self.assertEqual(set(bib), {'two', 'three', 'four'})
+        self.assertEqual(str(bib['two'].title), 'Modified')
+        self.assertIs(bib['three'], unchanged)
+        # a modified @string definition affects all entries
+        write(REFRESH_BIB.replace('Publisher', 'Other Publisher'))
+        self.assertEqual(bib.refresh(), {'one', 'two', 'three', 'four'})
+        self.assertEqual(str(bib['three'].publisher), 'Other Publisher')
+
+    def test_refresh_at_sign_in_field(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        bib_path = os.path.join(temp_dir, 'refresh.bib')
+
+        def write(text):
+            with open(bib_path, 'w', encoding='utf-8') as bib_file:
+                bib_file.write(text)
+
+        text = ('@book{one, title={First}, year={2001},\n'
+                '  note={A note\n@book{two, about the other book}}}\n'
+                '@book{two, title={Second}, year={2002}}\n')
+        write(text)
+        bib = BibTeX(bib_path, encoding='utf-8', watch=True)
+        self.assertEqual(bib.refresh(), set())
+        write(text.replace('A note', 'A modified note'))
+        self.assertEqual(bib.refresh(), {'one'})
+        self.assertEqual(set(bib), {'one', 'two'})
+        self.assertTrue(str(bib['one'].note).startswith('A modified note'))
+        self.assertEqual(str(bib['two'].title), 'Second')
+
+
+REFRESH_BIB = '''@string{pub = {Publisher}}
+@book{one, title={First}, year={2001}}
+@book{two, title={Second}, year={2002}}
+@book{three, title={Third}, publisher=pub, year={2003}}
+'''
+
 
 SPLIT_NAMES = [
     ('AA BB', ['AA BB']),
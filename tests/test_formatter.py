@@ -0,0 +1,237 @@
+import io
+
+from unittest import TestCase
+
+from citeproc import (Citation, CitationItem, CitationStylesBibliography,
+                      CitationStylesStyle, formatter)
+from citeproc.cache import RenderCache
+from citeproc.source.json import CiteProcJSON
+from citeproc.formatter import tree
+from citeproc.string import String
+
+
+REFERENCES = [
+    {"id": "latini", "type": "book", "title": "La Rettorica",
+     "author": [{"family": "Latini", "given": "Brunetto"}],
+     "issued": {"date-parts": [[1968]]}, "publisher": "Le Monnier",
+     "publisher-place": "Firenze"},
+    {"id": "doe", "type": "article-journal",
+     "title": "Cells & <molecules>", "container-title": "Nature",
+     "author": [{"family": "Doe", "given": "John"},
+                {"family": "Roe", "given": "Jane"}],
+     "issued": {"date-parts": [[2001]]}, "volume": "12", "page": "1-10"},
+]
+
+
+def render(output_formatter):
+    style = CitationStylesStyle('harvard-cite-them-right', validate=False)
+    bibliography = CitationStylesBibliography(style, CiteProcJSON(REFERENCES),
+                                              output_formatter)
+    bibliography.register(Citation([CitationItem('latini'),
+                                    CitationItem('doe')]))
+    bibliography.sort()
+    return bibliography.bibliography()
+
+
+# reference fields with markup and ampersands are passed through as-is by
+# the eager formatters, while terms are escaped
+MARKUP = [
+    {"id": "obrien", "type": "article-journal",
+     "title": "Cells & <i>molecules</i>", "container-title": "R&D",
+     "author": [{"literal": "O'Brien & Co"}],
+     "issued": {"date-parts": [[2001]]}},
+    {"id": "smith", "type": "book", "title": "Tom & Jerry",
+     "author": [{"family": "Smith", "given": "A."},
+                {"family": "Jones", "given": "B."}],
+     "issued": {"date-parts": [[1999]]}, "publisher": "Q&A Press"},
+]
+MARKUP.append({"id": "roe", "type": "book", "title": "Why?",
+               "author": [{"family": "Roe", "given": "C."},
+                          {"family": "Poe", "given": "D."},
+                          {"family": "Moe", "given": "E."}],
+               "issued": {"date-parts": [[2005]]}})
+
+# small caps and italics next to duplicated punctuation, an ampersand term
+# and a constant text
+SEAMS_STYLE = b"""<style xmlns="http://purl.org/net/xbiblio/csl"
+    class="in-text" version="1.0">
+  <info><title>Seams</title><id>seams</id>
+    <updated>2024-01-01T00:00:00+00:00</updated></info>
+  <macro name="author">
+    <names variable="author">
+      <name and="symbol" font-variant="small-caps" initialize-with=". "
+            et-al-min="3" et-al-use-first="1"/>
+      <et-al font-style="italic"/>
+    </names>
+  </macro>
+  <citation>
+    <layout prefix="(" suffix=")" delimiter="; ">
+      <text macro="author"/>
+    </layout>
+  </citation>
+  <bibliography>
+    <sort><key macro="author"/></sort>
+    <layout suffix=".">
+      <group delimiter=". ">
+        <text macro="author"/>
+        <text variable="title" font-style="italic" suffix="."/>
+        <text value="R&amp;D"/>
+        <text variable="publisher"/>
+      </group>
+    </layout>
+  </bibliography>
+</style>"""
+
+
+class TestTreeFormatter(TestCase):
+    def test_plain(self):
+        expected = [str(entry) for entry in render(formatter.plain)]
+        entries = render(tree)
+        self.assertEqual([tree.serialize(entry, formatter.plain)
+                          for entry in entries], expected)
+        self.assertEqual([str(entry) for entry in entries], expected)
+
+    def test_spans(self):
+        entry = render(tree)[1]
+        spans = [item for item in list.__iter__(entry)
+                 if isinstance(item, tree.Span)]
+        self.assertEqual([(span.style, str(span)) for span in spans],
+                         [('Italic', 'La Rettorica')])
+
+    def test_html(self):
+        entries = [tree.serialize(entry, formatter.html)
+                   for entry in render(tree)]
+        self.assertIn('<i>La Rettorica</i>', entries[1])
+        # like the eager html formatter, reference fields are not escaped
+        self.assertIn('Cells & <molecules>', entries[0])
+        self.assertIn('<i>Nature</i>', entries[0])
+
+    def test_same_as_eager(self):
+        def render(style, output_formatter):
+            if isinstance(style, bytes):
+                style = io.BytesIO(style)
+            bibliography = CitationStylesBibliography(
+                CitationStylesStyle(style, validate=False),
+                CiteProcJSON(MARKUP), output_formatter)
+            citations = [Citation([CitationItem(reference['id'])])
+                         for reference in MARKUP]
+            bibliography.register_many(citations)
+            bibliography.sort()
+            return ([bibliography.cite(citation, None)
+                     for citation in citations]
+                    + bibliography.bibliography())
+
+        for style in ('harvard-cite-them-right', SEAMS_STYLE):
+            texts = render(style, tree)
+            for output_formatter in (formatter.html, formatter.rst,
+                                     formatter.plain):
+                self.assertEqual([tree.serialize(text, output_formatter)
+                                  for text in texts],
+                                 [str(text) for text
+                                  in render(style, output_formatter)])
+
+    def test_transform(self):
+        span = tree.Italic(String('a title'))
+        upper = span.upper()
+        self.assertIsInstance(upper, tree.Italic)
+        self.assertEqual(str(upper), 'A TITLE')
+        self.assertEqual(tree.serialize(upper, formatter.rst),
+                         ':emphasis:`A TITLE`')
+        self.assertEqual(tree.serialize(span + '.', formatter.html),
+                         '<i>a title</i>.')
+
+
+class TestMultipleFormats(TestCase):
+    def test_bibliography_formats(self):
+        style = CitationStylesStyle('harvard-cite-them-right', validate=False)
+        bibliography = CitationStylesBibliography(
+            style, CiteProcJSON(REFERENCES), formatter.html)
+        citation = Citation([CitationItem('latini')])
+        bibliography.register(citation)
+        bibliography.sort()
+        html, plain = bibliography.bibliography_formats([formatter.html,
+                                                         formatter.plain])
+        self.assertEqual(plain, [str(entry)
+                                 for entry in render(formatter.plain)][1:])
+        self.assertIn('<i>La Rettorica</i>', html[0])
+        # the bibliography's own formatter is left in place
+        self.assertEqual([str(entry) for entry in bibliography.bibliography()],
+                         html)
+        self.assertEqual(bibliography.cite_formats(citation, None,
+                                                   [formatter.rst]),
+                         ['(Latini, 1968)'])
+
+    def test_rendered_once(self):
+        formatters = [formatter.html, formatter.plain, formatter.rst]
+        cache = RenderCache()
+        bibliography = CitationStylesBibliography(
+            CitationStylesStyle('harvard-cite-them-right', validate=False),
+            CiteProcJSON(REFERENCES), formatter.html, cache=cache)
+        citation = Citation([CitationItem('latini')])
+        bibliography.register(citation)
+        self.assertEqual(len(bibliography.cite_formats(citation, None,
+                                                       formatters)), 3)
+        self.assertEqual(len(bibliography.bibliography_formats(formatters)),
+                         3)
+        # one rendering each of the citation and the bibliography entry
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_same_as_eager(self):
+        formatters = [formatter.html, formatter.plain, formatter.rst]
+        style = CitationStylesStyle('harvard-cite-them-right', validate=False)
+        citations = [Citation([CitationItem('obrien')]),
+                     Citation([CitationItem('smith'), CitationItem('obrien')])]
+
+        def create(output_formatter):
+            bibliography = CitationStylesBibliography(
+                style, CiteProcJSON(MARKUP), output_formatter)
+            bibliography.register_many(citations)
+            bibliography.sort()
+            return bibliography
+
+        expected_entries, expected_cites = [], []
+        for output_formatter in formatters:
+            bibliography = create(output_formatter)
+            expected_cites.append([str(bibliography.cite(citation, None))
+                                   for citation in citations])
+            expected_entries.append([str(entry) for entry
+                                     in bibliography.bibliography()])
+        bibliography = create(formatter.html)
+        self.assertEqual(bibliography.bibliography_formats(formatters),
+                         expected_entries)
+        cites = [bibliography.cite_formats(citation, None, formatters)
+                 for citation in citations]
+        self.assertEqual([list(texts) for texts in zip(*cites)],
+                         expected_cites)
+        self.assertEqual(len(bibliography._cites), 3)
+        self.assertIn('Cells & <i>molecules</i>', expected_entries[0][0])
+
+
+class TestSharedStyle(TestCase):
+    def test_formatters(self):
+        style = CitationStylesStyle('harvard-cite-them-right', validate=False)
+        bibliographies = [CitationStylesBibliography(style,
+                                                     CiteProcJSON(REFERENCES),
+                                                     output_formatter)
+                          for output_formatter in (formatter.html,
+                                                   formatter.plain)]
+        for bibliography in bibliographies:
+            bibliography.register(Citation([CitationItem('latini')]))
+        html, plain = (bibliography.bibliography()
+                       for bibliography in bibliographies)
+        self.assertIn('<i>La Rettorica</i>', str(html[0]))
+        self.assertNotIn('<i>', str(plain[0]))
+
+
+class TestWrappers(TestCase):
+    def test_wrap(self):
+        self.assertEqual(formatter.html.SmallCaps(String('a') + 'b'),
+                         '<span style="font-variant:small-caps;">ab</span>')
+        self.assertEqual(formatter.html.Oblique('text'), '<i>text</i>')
+        self.assertEqual(formatter.rst.Bold('text'), ':strong:`text`')
+
+    def test_constants(self):
+        self.assertEqual(formatter.html.constants['AMPERSAND'], '&amp;')
+        self.assertEqual(formatter.plain.constants['EN DASH'], '–')
+        with self.assertRaises(KeyError):
+            formatter.rst.constants['NO SUCH CHARACTER']
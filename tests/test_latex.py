@@ -3,6 +3,7 @@
 from unittest import TestCase
 
 from citeproc.source.bibtex.latex import parse_latex, substitute_ligatures
+from citeproc.source.bibtex.latex.macro import Macro
 
 
 class TestLatex(TestCase):
@@ -49,7 +50,9 @@ class TestLatex(TestCase):
 
     # assorted string with macros
     ASSORTED = [('Escobar, María José', r"Escobar, Mar{\'\i}a Jos{\'e}"),
-                ('Escobar, María-José', r"Escobar, Mar\'{\i}a-Jos\'{e}")]
+                ('Escobar, María-José', r"Escobar, Mar\'{\i}a-Jos\'{e}"),
+                ('Umeå', r"Ume\aa"),
+                ('{braces}', r"\{braces\}")]
 
     WARNINGS = [('Åke José Édouard Gödel',
                  r"\AA{ke} {Jos{\'{e}} {\'{E}douard} G{\"o}del",
@@ -73,8 +76,43 @@ class TestLatex(TestCase):
         for reference, string in self.MATH:
             self.assertEqual(reference, parse_latex(string))
 
+    # a macro missing its argument before a closing brace or at the end of
+    # the string is dropped
+    MISSING_ARGUMENT = [('', r"{\'}"),
+                        ('', r"{\~}"),
+                        ('', r'{\"}'),
+                        ('a', r"{\c}a"),
+                        ('ab', r"a{b\c}"),
+                        ('Mot', 'Mot\\"'),
+                        ('Mot', 'Mot\\" '),
+                        ('é', r"\'e\'")]
+
+    def test_missing_argument(self):
+        for reference, string in self.MISSING_ARGUMENT:
+            self.assertEqual(reference, parse_latex(string))
+
+    def test_deep_nesting(self):
+        depth = 5000
+        string = r"\'" + '{' * depth + 'e' + '}' * depth + ' x'
+        self.assertEqual(parse_latex(string), 'é x')
+
+    def test_plain_string(self):
+        string = 'Journal of Applied Physics, vol. 1-2'
+        self.assertIs(parse_latex(string), string)
+
+    def test_macro_table(self):
+        string = r'\foo{} bar'
+        for expansion in ('one', 'two', 'one'):
+            macros = {'foo': Macro(0, expansion)}
+            self.assertEqual(parse_latex(string, macros), expansion + ' bar')
+
     LIGATURES = [('¿Que pasa?', "?`Que pasa?"),
-                 ('¡Que!', "!`Que!")]
+                 ('¡Que!', "!`Que!"),
+                 ('1–2', "1--2"),
+                 ('a—b', "a---b"),
+                 ('this!“x”', "this!``x''"),
+                 ('?“x', "?``x"),
+                 ('¡x“', "!`x``")]
 
     def test_substitute_ligatures(self):
         for reference, string in self.LIGATURES:
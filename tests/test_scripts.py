@@ -0,0 +1,84 @@
+import json
+import os
+import shutil
+import tempfile
+import warnings
+
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest import TestCase
+
+from citeproc import SQLiteRenderCache
+from citeproc.scripts import csl_render
+
+
+REFERENCES = [{"id": "ref{}".format(n), "type": "book",
+               "title": "Book {}".format(n),
+               "author": [{"family": "Author{}".format(4 - n)}],
+               "issued": {"date-parts": [[2000 + n]]}}
+              for n in range(5)]
+
+
+class TestRender(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'references.json')
+        with open(self.filename, 'w') as file:
+            json.dump(REFERENCES, file)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def render(self, *args):
+        output = StringIO()
+        with redirect_stdout(output):
+            csl_render.main(list(args) + [self.filename])
+        return [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def test_render(self):
+        records = self.render('-s', 'harvard-cite-them-right')
+        self.assertEqual([record['id'] for record in records],
+                         ['ref{}'.format(n) for n in range(5)])
+        self.assertEqual(records[0],
+                         {'id': 'ref0', 'citation': '(Author4, 2000)',
+                          'bibliography': 'Author4 (2000) Book 0.'})
+
+    def test_processes(self):
+        records = self.render('--sort', '--no-citations', '-j', '2',
+                              '--chunk-size', '2')
+        self.assertEqual([record['id'] for record in records],
+                         ['ref{}'.format(n) for n in reversed(range(5))])
+        self.assertEqual(records, self.render('--sort', '--no-citations'))
+
+    def test_processes_bibtex(self):
+        self.filename = os.path.join(self.directory, 'references.bib')
+        with open(self.filename, 'w') as file:
+            for n in range(5):
+                file.write('@book{{ref{0}, author={{Author{0}}}, '
+                           'title={{Book {{DNA}} {0}}}, year={{200{0}}}}}\n'
+                           .format(n))
+        records = self.render('-j', '2', '--chunk-size', '2')
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records, self.render())
+
+    def test_numbered(self):
+        records = self.render('-s', 'ieee', '--sort', '-j', '2',
+                              '--chunk-size', '2')
+        self.assertEqual([record['citation'] for record in records],
+                         ['[{}]'.format(n) for n in range(1, 6)])
+        self.assertEqual(records, self.render('-s', 'ieee', '--sort'))
+
+    def test_warnings_filter(self):
+        filters = list(warnings.filters)
+        self.render()
+        self.assertEqual(warnings.filters, filters)
+
+    def test_cache(self):
+        filename = os.path.join(self.directory, 'cache.sqlite')
+        expected = self.render()
+        self.assertEqual(self.render('--cache', filename), expected)
+        cache = SQLiteRenderCache(filename)
+        self.assertEqual(len(cache), 10)
+        cache.close()
+        self.assertEqual(self.render('--cache', filename, '-j', '2'),
+                         expected)
@@ -0,0 +1,439 @@
+# coding: utf-8
+
+import bz2
+import copy
+import gzip
+import json
+import lzma
+import os
+import pickle
+import shutil
+import tempfile
+import warnings
+
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+from unittest import TestCase
+
+from citeproc import (CitationStylesStyle, CitationStylesBibliography,
+                      Citation, CitationItem)
+from citeproc.source import (Diagnostics, InternPool, LazyReference,
+                             Reference, VariableError, open_text)
+from citeproc.source.bibtex import BibTeX
+from citeproc.source.chain import ChainedSource
+from citeproc.source.json import CiteProcJSON, iter_records
+from citeproc.source.sqlite import SQLiteSource
+from citeproc.source.store import StoreSource, SharedMemorySource
+from citeproc.string import NoCase
+
+
+class TestInternPool(TestCase):
+    def test_bibtex(self):
+        pool = InternPool()
+        bib = BibTeX(StringIO(BIBTEX), intern_pool=pool)
+        one, two = bib['one'], bib['two']
+        self.assertIs(one.author[0], two.author[1])
+        self.assertIs(one.publisher, two.publisher)
+        self.assertIsNot(one.title, two.title)
+        self.assertEqual(str(two.author[1].family), 'Doe')
+        self.assertEqual(pool.hits, 2)
+        self.assertEqual(pool.hit_rate, 2 / 5)
+
+    def test_shared_between_sources(self):
+        pool = InternPool()
+        first = CiteProcJSON(JSON, intern_pool=pool)
+        second = CiteProcJSON(JSON, intern_pool=pool)
+        self.assertIs(first['one'].author[0], second['one'].author[0])
+        self.assertIs(first['one'].container_title,
+                      second['two'].container_title)
+        self.assertEqual(len(pool), 3)
+
+    def test_preamble_macros(self):
+        pool = InternPool()
+        entry = '@book{one, title={A}, publisher={\\pub}, author={\\pub}}'
+        sources = [BibTeX(StringIO('@preamble{"\\newcommand{\\pub}{%s}"}\n'
+                                   % publisher + entry), intern_pool=pool)
+                   for publisher in ('Springer', 'Elsevier')]
+        self.assertEqual([str(source['one'].publisher) for source in sources],
+                         ['Springer', 'Elsevier'])
+        self.assertEqual([str(source['one'].author[0].family)
+                          for source in sources], ['Springer', 'Elsevier'])
+
+
+class TestStreamingJSON(TestCase):
+    def test_array(self):
+        text = json.dumps(JSON, indent=2)
+        records = list(iter_records(StringIO(text), chunk_size=7))
+        self.assertEqual(records, JSON)
+        self.assertEqual(list(iter_records(StringIO(' [ ] '))), [])
+
+    def test_ndjson(self):
+        text = '\n'.join(json.dumps(record) for record in JSON) + '\n\n'
+        source = CiteProcJSON.from_file(StringIO(text))
+        self.assertEqual(sorted(source), ['one', 'two'])
+        self.assertEqual(str(source['two'].container_title), 'Nature')
+
+    def test_large_record(self):
+        record = dict(JSON[0], abstract='x' * 100000)
+        file = StringIO(json.dumps([record, JSON[1]]))
+        reads = []
+        read = file.read
+        file.read = lambda size: reads.append(size) or read(size)
+        records = list(iter_records(file, chunk_size=100))
+        self.assertEqual(records, [record, JSON[1]])
+        self.assertLess(len(reads), 20)
+
+    def test_truncated(self):
+        text = json.dumps(JSON)[:-10]
+        with self.assertRaises(ValueError):
+            list(iter_records(StringIO(text), chunk_size=16))
+
+
+class TestLazyReference(TestCase):
+    def test_convert_on_access(self):
+        source = CiteProcJSON(JSON, lazy=True)
+        reference = source['one']
+        self.assertIsInstance(reference, LazyReference)
+        self.assertIn('title', reference)
+        self.assertEqual(reference._pending,
+                         {'title', 'author', 'container_title'})
+        title = reference.title
+        self.assertEqual(str(title), 'One')
+        self.assertIs(reference['title'], title)
+        self.assertEqual(reference.get('author')[0].family, 'Doe')
+        self.assertEqual(reference._pending, {'container_title'})
+        self.assertIsNone(reference.get('note'))
+        with self.assertRaises(VariableError):
+            reference.note
+
+    def test_same_as_eager(self):
+        lazy, eager = CiteProcJSON(JSON, lazy=True), CiteProcJSON(JSON)
+        for key in eager:
+            self.assertEqual(lazy[key].items(), list(eager[key].items()))
+
+
+class TestSQLiteSource(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'references.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_import(self):
+        source = SQLiteSource.from_source(self.filename, CiteProcJSON(JSON),
+                                          cache_size=1)
+        source.add_many(BibTeX(StringIO(BIBTEX)).values())
+        self.assertEqual(len(source), 2)
+        self.assertEqual(sorted(source), ['one', 'two'])
+        self.assertIn('one', source)
+        self.assertNotIn('three', source)
+        self.assertIsNone(source.get('three'))
+        one = source['one']
+        self.assertEqual(one.type, 'book')
+        self.assertEqual(str(one.publisher), 'Springer')
+        self.assertIs(source['one'], one)
+        source['two']
+        self.assertIsNot(source['one'], one)
+        source.close()
+
+    def test_get_many(self):
+        source = SQLiteSource.from_source(self.filename, CiteProcJSON(JSON))
+        references = source.get_many(['one', 'two', 'three'])
+        self.assertEqual(sorted(references), ['one', 'two'])
+        self.assertIs(source['two'], references['two'])
+        source.close()
+
+    def test_prefetch(self):
+        references = [dict(JSON[0], id='ref{}'.format(n)) for n in range(20)]
+        source = SQLiteSource.from_source(self.filename,
+                                          CiteProcJSON(references),
+                                          cache_size=4)
+        source.BATCH_SIZE = 3
+        keys = ['ref{}'.format(n) for n in range(10)]
+        source.prefetch(keys + keys[:2])
+        self.assertEqual(len(source.cache), 10)
+        cached = [source.cache.get(key) for key in keys]
+        self.assertNotIn(None, cached)
+        self.assertEqual([source[key] for key in keys], cached)
+        source.close()
+
+    def test_modify(self):
+        source = SQLiteSource.from_source(self.filename, CiteProcJSON(JSON))
+        bibtex = BibTeX(StringIO(BIBTEX))
+        source['three'] = bibtex['one']
+        self.assertEqual(str(source['three'].publisher), 'Springer')
+        del source['one']
+        self.assertEqual(sorted(source), ['three', 'two'])
+        with self.assertRaises(KeyError):
+            del source['one']
+        self.assertEqual(source.pop('three').type, 'book')
+        self.assertIsNone(source.pop('three', None))
+        self.assertEqual(source.setdefault('two', None).type,
+                         'article-journal')
+        source.update(one=bibtex['one'])
+        self.assertEqual(sorted(source), ['one', 'two'])
+        key, reference = source.popitem()
+        self.assertNotIn(key, source)
+        source.clear()
+        self.assertEqual(len(source), 0)
+        self.assertEqual(len(SQLiteSource(self.filename)), 0)
+        source.close()
+
+    def test_pickle(self):
+        source = SQLiteSource.from_source(self.filename,
+                                          CiteProcJSON(JSON, lazy=True))
+        copy = pickle.loads(pickle.dumps(source))
+        self.assertEqual(copy['two'].author[0].family, 'Roe')
+        source.close()
+        copy.close()
+
+
+class TestStoreSource(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'references.store')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        bibtex = BibTeX(StringIO(BIBTEX))
+        source = CiteProcJSON(JSON + [STORE_JSON])
+        source.update(bibtex)
+        source['one'].note = ('pickled', 1)
+        store = StoreSource.from_source(self.filename, source, cache_size=2)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(list(store), ['one', 'three', 'two'])
+        self.assertNotIn('four', store)
+        self.assertRaises(KeyError, store.__getitem__, 'four')
+        for key, reference in source.items():
+            self.assertEqual(set(store[key]), set(reference))
+            for name, value in reference.items():
+                self.assertEqual(plain(store[key][name]), plain(value))
+                self.assertIs(type(store[key][name]), type(value))
+        three = store['three']
+        self.assertIs(type(list(three.title)[1]), NoCase)
+        self.assertEqual(three.issued.end.sort_key(), '120030000')
+        self.assertIs(store['three'], three)
+        copy = pickle.loads(pickle.dumps(store))
+        self.assertEqual(copy['two'].author[1].family, 'Doe')
+        copy.close()
+        store.close()
+
+    def test_read_only(self):
+        store = StoreSource.from_source(self.filename, CiteProcJSON(JSON))
+        reference = CiteProcJSON([STORE_JSON])['three']
+        for modify in (lambda: store.add(reference),
+                       lambda: store.__setitem__('three', reference),
+                       lambda: store.__delitem__('one'),
+                       lambda: store.update(three=reference),
+                       lambda: store.pop('one'), store.popitem,
+                       lambda: store.setdefault('three', reference),
+                       store.clear):
+            self.assertRaises(TypeError, modify)
+        self.assertEqual(sorted(store), ['one', 'two'])
+        store.close()
+
+
+def shared_family_names(source, key):
+    return [str(name.family) for name in source[key].author]
+
+
+class TestSharedMemorySource(TestCase):
+    def test_workers(self):
+        shared = SharedMemorySource.publish(BibTeX(StringIO(BIBTEX)))
+        try:
+            self.assertEqual(len(shared), 2)
+            with ProcessPoolExecutor(max_workers=2) as executor:
+                results = list(executor.map(shared_family_names,
+                                            [shared, shared], ['one', 'two']))
+            self.assertEqual(results, [['Doe'], ['Roe', 'Doe']])
+            self.assertEqual(str(shared['one'].title), 'One')
+        finally:
+            shared.unlink()
+
+
+class TestPickle(TestCase):
+    def assertRoundTrip(self, obj):
+        restored = pickle.loads(pickle.dumps(obj))
+        self.assertIs(type(restored), type(obj))
+        self.assertEqual(plain(restored), plain(obj))
+
+    def test_references(self):
+        source = CiteProcJSON(JSON + [STORE_JSON])
+        for reference in source.values():
+            self.assertRoundTrip(reference)
+        for reference in BibTeX(StringIO(BIBTEX)).values():
+            self.assertRoundTrip(reference)
+        self.assertEqual(copy.deepcopy(source['one']), source['one'])
+
+    def test_lazy_reference(self):
+        source = CiteProcJSON(JSON, lazy=True)
+        reference = pickle.loads(pickle.dumps(source['one']))
+        self.assertIs(type(reference), Reference)
+        self.assertEqual(reference, CiteProcJSON(JSON)['one'])
+
+    def test_citations(self):
+        source = CiteProcJSON(JSON)
+        style = CitationStylesStyle('harvard-cite-them-right', validate=False)
+        bibliography = CitationStylesBibliography(style, source)
+        citation = Citation([CitationItem('one', locator='12'),
+                             CitationItem('two')])
+        bibliography.register(citation)
+        restored = pickle.loads(pickle.dumps(citation))
+        self.assertNotIn('bibliography', restored)
+        self.assertEqual([cite.key for cite in restored.cites], ['one', 'two'])
+        self.assertEqual(restored.cites[0].locator, '12')
+        for cite in restored.cites:
+            self.assertIs(cite.citation, restored)
+
+    def test_copy(self):
+        source = CiteProcJSON(JSON)
+        style = CitationStylesStyle('harvard-cite-them-right', validate=False)
+        bibliography = CitationStylesBibliography(style, source)
+        citation = Citation([CitationItem('one'), CitationItem('two')])
+        bibliography.register(citation)
+        duplicate = copy.copy(citation)
+        self.assertIs(duplicate.bibliography, bibliography)
+        self.assertIs(duplicate.cites, citation.cites)
+        for cite in citation.cites:
+            self.assertIs(cite.citation, citation)
+        item = copy.copy(citation.cites[0])
+        self.assertIs(item.citation, citation)
+        self.assertEqual(item.key, 'one')
+
+
+class TestDiagnostics(TestCase):
+    def test_collect(self):
+        diagnostics = Diagnostics(max_samples=1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            bibtex = BibTeX(StringIO(DIAGNOSTICS_BIBTEX),
+                            diagnostics=diagnostics)
+            CiteProcJSON([{'id': 'four', 'type': 'book', 'color': 'red'}],
+                         diagnostics=diagnostics)
+        self.assertEqual(sorted(bibtex), ['one', 'two'])
+        self.assertEqual(diagnostics.counts,
+                         {('unsupported field', 'eprinttype'): 2,
+                          ('unsupported type', 'software'): 1,
+                          ('unsupported argument', 'Reference.color'): 1})
+        samples = diagnostics.samples['unsupported field', 'eprinttype']
+        self.assertEqual(samples, ['one'])
+        self.assertEqual(diagnostics.summary().splitlines()[0],
+                         "unsupported field 'eprinttype': 2 (e.g. one)")
+
+
+class TestCompressedInput(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, filename, text, open_file=open):
+        path = os.path.join(self.directory, filename)
+        with open_file(path, 'wt', encoding='utf-8') as file:
+            file.write(text)
+        return path
+
+    def test_open_text(self):
+        for open_file in (open, gzip.open, bz2.open, lzma.open):
+            path = self.write('text', 'Ré\n', open_file)
+            with open_text(path, 'utf-8') as file:
+                self.assertEqual(file.read(), 'Ré\n')
+
+    def test_sources(self):
+        bib = self.write('references.bib.xz', BIBTEX, lzma.open)
+        self.assertEqual(sorted(BibTeX(bib)), ['one', 'two'])
+        self.assertEqual(sorted(BibTeX(bib, watch=True)), ['one', 'two'])
+        ndjson = '\n'.join(json.dumps(record) for record in JSON)
+        path = self.write('references.ndjson.gz', ndjson, gzip.open)
+        self.assertEqual(sorted(CiteProcJSON.from_file(path)), ['one', 'two'])
+
+
+class TestPrefetch(TestCase):
+    class Source(CiteProcJSON):
+        def prefetch(self, keys):
+            self.prefetched.append(sorted(keys))
+
+    def test_register_many(self):
+        source = self.Source(JSON)
+        source.prefetched = []
+        style = CitationStylesStyle('harvard-cite-them-right', validate=False)
+        bibliography = CitationStylesBibliography(style, source)
+        citations = [Citation([CitationItem('two'), CitationItem('one')]),
+                     Citation([CitationItem('one'), CitationItem('three')])]
+        missing = []
+        bibliography.register_many(citations, missing.append)
+        self.assertEqual(source.prefetched, [['one', 'one', 'three', 'two']])
+        self.assertEqual(bibliography.keys, ['two', 'one'])
+        self.assertEqual([item.key for item in missing], ['three'])
+        bibliography.register(Citation([CitationItem('one')]))
+        self.assertEqual(source.prefetched[-1], ['one'])
+
+    def test_plain_dict(self):
+        source = dict(CiteProcJSON(JSON))
+        style = CitationStylesStyle('harvard-cite-them-right', validate=False)
+        bibliography = CitationStylesBibliography(style, source)
+        bibliography.register(Citation([CitationItem('one')]))
+        bibliography.register_many([Citation([CitationItem('two')])])
+        self.assertEqual(bibliography.keys, ['one', 'two'])
+
+
+class TestChainedSource(TestCase):
+    def test_priority(self):
+        bibtex = BibTeX(StringIO(BIBTEX))
+        csl_json = CiteProcJSON(JSON + [{'id': 'three', 'type': 'book'}],
+                                lazy=True)
+        chain = ChainedSource(csl_json, bibtex)
+        self.assertEqual(len(chain), 3)
+        self.assertEqual(sorted(chain), ['one', 'three', 'two'])
+        self.assertIs(chain['one'], csl_json['one'])
+        self.assertIs(chain['three'], csl_json['three'])
+        self.assertIsNone(chain.get('four'))
+        self.assertNotIn('four', chain)
+        self.assertEqual(chain.collisions, {'one': [csl_json, bibtex],
+                                            'two': [csl_json, bibtex]})
+        references = ChainedSource(bibtex, csl_json).get_many(
+            ['three', 'one', 'four'])
+        self.assertEqual(list(references.values()),
+                         [bibtex['one'], csl_json['three']])
+
+
+def plain(value):
+    # DateRange doesn't support comparison
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    elif isinstance(value, list):
+        return [(type(item), plain(item)) for item in list.__iter__(value)]
+    return value
+
+
+STORE_JSON = {'id': 'three', 'type': 'book', 'edition': 2,
+              'title': 'A <span class="nocase">B</span> c',
+              'author': [{'literal': 'ACME'}],
+              'issued': {'date-parts': [[2001, 2, 3], [2003]], 'circa': 1},
+              'accessed': {'literal': 'ca. 2000'},
+              'language': 'en'}
+
+
+DIAGNOSTICS_BIBTEX = r"""
+@book{one, title={One}, eprinttype={1}}
+@book{two, title={Two}, eprinttype={2}}
+@software{three, title={Three}}
+"""
+
+
+BIBTEX = r"""
+@book{one, author={Doe, John}, title={One}, publisher={Springer}, year=2001}
+@book{two, author={Roe, Jane and John Doe}, title={Two},
+           publisher={Springer}, year=2002}
+"""
+
+JSON = [{'id': 'one', 'type': 'article-journal', 'title': 'One',
+         'author': [{'family': 'Doe', 'given': 'John'}],
+         'container-title': 'Nature'},
+        {'id': 'two', 'type': 'article-journal', 'title': 'Two',
+         'author': [{'family': 'Roe', 'given': 'Jane'}],
+         'container-title': 'Nature'}]